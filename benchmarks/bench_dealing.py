@@ -0,0 +1,73 @@
+""" Cost of the word statistics: a press, a flush, and dealing a round
+uniformly vs by weights drawn from the alias table.
+
+A synthetic pack gets a random skip rate per word and `--presses` presses,
+which are flushed into a temporary SQLite store like the bot does. Then one
+game deck deals rounds of 20 played words. Run from the repository root:
+    python -m benchmarks.bench_dealing --words 100000
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import timeit
+from data.loaders import WORD_PACKS, WordPack
+from game.deck import GameDeck, RoundDeck
+from game.stats import WordStats
+from game.store import SQLiteWordStatsStore
+from benchmarks.bench_packs import make_entries
+
+
+def deal_rounds(pack, sampler, rounds: int) -> float:
+    """ Seconds per dealt round, the skipped words go back like at a round end """
+    deck = GameDeck(pack)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        round_deck = RoundDeck(deck, sampler=sampler)
+        round_deck.cursor = 20
+        round_deck.skipped.extend(round_deck.indices[:5])
+        round_deck.finish()
+    return (time.perf_counter() - started) / rounds
+
+def skip_share(pack, sampler, skipped_words: set, rounds: int) -> float:
+    """ Share of dealt words that players skip more often than not """
+    deck = GameDeck(pack)
+    dealt = [index for _ in range(rounds) for index in deck.deal(20, sampler)]
+    return sum(index in skipped_words for index in dealt) / len(dealt)
+
+async def run(args) -> None:
+    pack = WordPack("bench", tuple(make_entries(args.words)), 0.0)
+    WORD_PACKS[pack.pack_id] = pack
+    with tempfile.TemporaryDirectory() as directory:
+        stats = WordStats(SQLiteWordStatsStore(os.path.join(directory, "stats.db")), "skipped")
+        random.seed(1)
+        skip_rates = [random.random() for _ in range(len(pack))]
+        presses = []
+        for _ in range(args.presses):
+            index = random.randrange(len(pack))
+            presses.append((index, random.random() >= skip_rates[index]))
+        seconds = timeit.timeit(lambda: [stats.record(pack, index, explained) for index, explained in presses], number=1)
+        print(f"record       {seconds / len(presses) * 1e6:8.2f} us per press")
+
+        started = time.perf_counter()
+        rows = await stats.flush()
+        print(f"flush        {(time.perf_counter() - started) * 1e3:8.1f} ms for {rows} rows and the alias table")
+
+        sampler = stats.sampler(pack)
+        skipped_words = {index for index, rate in enumerate(skip_rates) if rate > 0.5}
+        rounds = max(1, len(pack) // 50)
+        for name, round_sampler in (("uniform", None), ("weighted", sampler)):
+            per_round = deal_rounds(pack, round_sampler, rounds)
+            share = skip_share(pack, round_sampler, skipped_words, min(rounds, 100))
+            print(f"{name:<12} {per_round * 1e6:8.1f} us per round, {share:.1%} often skipped words dealt")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=500, help="pack size, the shipped packs have about 500")
+    parser.add_argument("--presses", type=int, default=100000)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+""" Startup time and memory of a large word pack: JSON vs the compiled .pack.
+
+A synthetic pack is written in both formats to a temporary directory. Each
+measurement runs in a fresh process: load the pack the way data.loaders
+does, then read `--reads` random words as a round would. Run from the
+repository root:
+    python -m benchmarks.bench_packs --words 100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import tempfile
+import multiprocessing
+from data.packfile import BinaryWordPack, compile_pack
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def random_word(alphabet: str, low: int, high: int) -> str:
+    return "".join(random.choice(alphabet) for _ in range(random.randint(low, high)))
+
+def make_entries(count: int) -> list:
+    random.seed(0)
+    cyrillic = "абвгдеёжзийклмнопрстуфхцчшщыэюя"
+    words = set()
+    while len(words) < count:
+        words.add(random_word(string.ascii_lowercase + "-", 4, 14))
+    return [(word, random_word(cyrillic + " ()", 4, 20)) for word in words]
+
+def load_json(path: str):
+    from data.loaders import WordPack
+    with open(path, 'r', encoding='utf-8') as f:
+        words = json.load(f)
+    return WordPack("bench", tuple((sys.intern(w), sys.intern(t)) for w, t in words.items()), 0.0)
+
+def load_compiled(path: str):
+    return BinaryWordPack("bench", path, 0.0)
+
+def measure(kind: str, path: str, reads: int, results) -> None:
+    """ Runs in a fresh process """
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    pack = load_json(path) if kind == "json" else load_compiled(path)
+    loaded = time.perf_counter() - started
+    rss_loaded = rss_bytes()
+
+    random.seed(1)
+    started = time.perf_counter()
+    for index in random.sample(range(len(pack)), min(reads, len(pack))):
+        pack[index]
+        pack.display(index)
+    read_time = time.perf_counter() - started
+    results.put((kind, loaded, rss_loaded - rss_before, read_time, rss_bytes() - rss_before))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=100000)
+    parser.add_argument("--reads", type=int, default=1000, help="random words read after loading")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    entries = make_entries(args.words)
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {"json": os.path.join(directory, "bench.json"), "pack": os.path.join(directory, "bench.pack")}
+        with open(paths["json"], 'w', encoding='utf-8') as f:
+            json.dump(dict(entries), f, ensure_ascii=False, indent=4)
+        with open(paths["pack"], 'wb') as f:
+            f.write(compile_pack(entries))
+
+        print(f"words: {args.words}, json: {os.path.getsize(paths['json']) / 2**20:.1f} MiB, "
+              f"pack: {os.path.getsize(paths['pack']) / 2**20:.1f} MiB")
+        for kind, path in paths.items():
+            runs = []
+            for _ in range(args.repeat):
+                results = context.Queue()
+                process = context.Process(target=measure, args=(kind, path, args.reads, results))
+                process.start()
+                runs.append(results.get())
+                process.join()
+            _, loaded, rss_loaded, read_time, rss_read = min(runs, key=lambda run: run[1])
+            print(f"{kind:<5} load {loaded * 1000:8.2f} ms  rss +{rss_loaded / 2**20:6.1f} MiB  "
+                  f"{args.reads} reads {read_time * 1000:6.2f} ms  rss after reads +{rss_read / 2**20:6.1f} MiB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+""" Cost of rendering a word card and a round summary, per word.
+
+"escape" is the old path: every card escapes the word and the translation
+and builds a new keyboard, the summary escapes every word of the round
+again at its end. "cached" is game.render: pack entries escaped at load,
+cards cached per entry, summary lines rendered as the words are played.
+Both build the keyboard per card, it carries the card's version.
+Run from the repository root:
+    python -m benchmarks.bench_render --rounds 2000
+"""
+import random
+import argparse
+import timeit
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from data.loaders import WordPack
+from data.packfile import escape
+from game import render
+from benchmarks.bench_packs import make_entries
+
+
+def escape_card(pack, index: int) -> tuple:
+    word, translation = pack[index]
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Understood", callback_data='word_explained')],
+        [InlineKeyboardButton("❌ Skip", callback_data='word_skipped')]
+    ])
+    return f"📝📝📝 *{escape(word)}* 📝📝📝 \n\n🌐 Translation: \\(_{escape(translation)}_\\)", keyboard
+
+def cached_card(pack, index: int) -> tuple:
+    return render.word_card(pack, index), render.word_keyboard(f"1.1.{index:x}")
+
+def escape_round(pack, indices) -> str:
+    words = []
+    for index in indices:
+        escape_card(pack, index)
+        words.append(pack[index])
+    return "\n".join(f"✅ *{escape(w)}* \\(_{escape(t)}_\\)" for w, t in words)
+
+def cached_round(pack, indices) -> str:
+    lines = []
+    for index in indices:
+        cached_card(pack, index)
+        lines.append(render.summary_line(True, *pack.display(index)))
+    return "\n".join(lines)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=500, help="pack size, the shipped packs have about 500")
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--round-words", type=int, default=20, help="words played per round")
+    args = parser.parse_args()
+
+    pack = WordPack("bench", tuple(make_entries(args.words)), 0.0)
+    random.seed(2)
+    rounds = [random.sample(range(len(pack)), args.round_words) for _ in range(args.rounds)]
+    assert all(escape_round(pack, r) == cached_round(pack, r) for r in rounds[:10])
+
+    played = args.rounds * args.round_words
+    for name, play in (("escape", escape_round), ("cached", cached_round)):
+        seconds = min(timeit.repeat(lambda: [play(pack, r) for r in rounds], number=1, repeat=3))
+        print(f"{name:<6} {seconds / played * 1e6:6.2f} us per word ({played} words)")
+    info = render.word_card.cache_info()
+    print(f"card cache: {info.hits} hits, {info.misses} misses, {info.currsize} cards")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+""" Throughput of the sharded mode for a growing number of worker processes.
+
+The driver process plays as the front: it routes updates with the real
+ShardRouter, the workers run the real handlers against a fake Bot API and
+report every message they send back to the driver, so the players can
+press the buttons they see. Players are closed-loop: they press the next
+button as soon as the bot answered the previous one. Run from the
+repository root:
+    python -m benchmarks.bench_sharding --workers 1,2,4 --chats 200 --duration 10
+"""
+import os
+import time
+import queue
+import asyncio
+import logging
+import argparse
+import tempfile
+from benchmarks.fakes import FakeRequest, UpdateFactory, ensure_config
+from utils.logger import LOGGER
+
+
+class ReportingRequest(FakeRequest):
+    """ FakeRequest of a worker, sends (chat_id, message_id, buttons) of every
+    sent, edited or deleted message to the driver """
+
+    def __init__(self, events, latency: float = 0.0) -> None:
+        super().__init__(latency=latency)
+        self.events = events
+
+    def answer(self, endpoint: str, parameters: dict):
+        result = super().answer(endpoint, parameters)
+        if endpoint in ("sendMessage", "editMessageText", "deleteMessage"):
+            chat_id = int(parameters["chat_id"])
+            message_id = result["message_id"] if isinstance(result, dict) else int(parameters["message_id"])
+            self.events.put((chat_id, message_id, self.keyboards.get(chat_id, {}).get(message_id)))
+        return result
+
+
+def bench_worker(shard_id: int, inbox, acks, events, db_path: str, latency: float, live: bool) -> None:
+    """ Worker process target: run_bot's shard worker with a reporting fake API """
+    ensure_config(STATE_STORE="sqlite", STATE_DB_PATH=db_path, LIVE_WORD_CARD=live, OUTBOX_RATE=0, OUTBOX_CHAT_RATE=0)
+    import run_bot
+    quiet_logs()
+    run_bot.ROUND_COUNTDOWN = 0
+    run_bot.run_shard_worker(shard_id, inbox, acks, request=ReportingRequest(events, latency))
+
+
+def quiet_logs() -> None:
+    for name in ("apscheduler", "telegram.ext", LOGGER.name):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+class KeyboardMirror:
+    """ Driver side copy of the keyboards the workers reported """
+
+    def __init__(self) -> None:
+        self.keyboards = {} # chat_id -> {message_id: [callback_data]}
+        self.versions = {}
+        self.changed = {}
+
+    def apply(self, chat_id: int, message_id: int, buttons: list) -> None:
+        keyboards = self.keyboards.setdefault(chat_id, {})
+        keyboards.pop(message_id, None)
+        if buttons:
+            keyboards[message_id] = buttons
+        self.versions[chat_id] = self.versions.get(chat_id, 0) + 1
+        self.changed.setdefault(chat_id, asyncio.Event()).set()
+
+    def find_button(self, chat_id: int, prefix: str) -> tuple:
+        for message_id, buttons in reversed(self.keyboards.get(chat_id, {}).items()):
+            for data in buttons:
+                if data.startswith(prefix):
+                    return message_id, data
+        return None, None
+
+    async def wait_change(self, chat_id: int, version: int, timeout: float) -> bool:
+        event = self.changed.setdefault(chat_id, asyncio.Event())
+        deadline = time.monotonic() + timeout
+        while self.versions.get(chat_id, 0) <= version:
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), deadline - time.monotonic())
+            except (asyncio.TimeoutError, ValueError):
+                return False
+        return True
+
+
+class ShardingBenchmark:
+    def __init__(self, args: argparse.Namespace, num_workers: int) -> None:
+        self.args = args
+        self.num_workers = num_workers
+        self.factory = UpdateFactory()
+        self.mirror = KeyboardMirror()
+        self.updates = 0
+        self.stalls = 0
+        self.router = None
+
+    async def read_events(self, events) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, events.get)
+            while event is not None:
+                self.mirror.apply(*event)
+                try:
+                    event = events.get_nowait()
+                except queue.Empty:
+                    break
+            if event is None:
+                return
+
+    async def send(self, chat_id: int, data: dict) -> None:
+        """ Route one update and wait until the bot reacted in the chat """
+        version = self.mirror.versions.get(chat_id, 0)
+        await self.router.dispatch(data)
+        self.updates += 1
+        if not await self.mirror.wait_change(chat_id, version, self.args.timeout):
+            self.stalls += 1
+
+    async def press(self, chat_id: int, prefix: str) -> None:
+        message_id, data = self.mirror.find_button(chat_id, prefix)
+        if message_id is not None:
+            await self.send(chat_id, self.factory.callback(chat_id, chat_id, message_id, data))
+
+    async def play_chat(self, chat_id: int, deadline: float) -> None:
+        await self.send(chat_id, self.factory.message(chat_id, chat_id, "/start"))
+        await self.press(chat_id, "start_game")
+        await self.press(chat_id, "set_lang_")
+        await self.press(chat_id, "set_difficulty_")
+        for text in ("2", "Red", "Blue", str(self.args.round_time), "100000"):
+            await self.send(chat_id, self.factory.message(chat_id, chat_id, text))
+
+        while time.monotonic() < deadline:
+            for prefix in ("start_next_round", "word_"):
+                message_id, data = self.mirror.find_button(chat_id, prefix)
+                if message_id is not None:
+                    await self.send(chat_id, self.factory.callback(chat_id, chat_id, message_id, data))
+                    break
+            else: # between two cards, wait for the next one
+                await self.mirror.wait_change(chat_id, self.mirror.versions.get(chat_id, 0), self.args.timeout)
+        await self.router.dispatch(self.factory.message(chat_id, chat_id, "/cancel"))
+
+    async def scale_up(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        await self.router.add_worker()
+        print(f"  worker added in {time.perf_counter() - started:.2f}s")
+
+    async def run(self) -> dict:
+        from utils.sharding import ShardRouter
+
+        args = self.args
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "game_states.db")
+            router = ShardRouter(bench_worker)
+            events = router.context.Queue()
+            router.args = (events, db_path, args.latency, args.live)
+            self.router = router
+            reader = asyncio.create_task(self.read_events(events))
+
+            await router.start(self.num_workers)
+            started = time.monotonic()
+            deadline = started + args.duration
+            tasks = [self.play_chat(chat_id, deadline) for chat_id in range(1, args.chats + 1)]
+            if args.scale_up:
+                tasks.append(self.scale_up(args.duration / 2))
+            await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - started
+            workers = len(router.workers)
+
+            await router.stop()
+            events.put(None)
+            await reader
+        return {
+            "workers": workers,
+            "elapsed": elapsed,
+            "updates": self.updates,
+            "stalls": self.stalls,
+            "rebalances": router.counters["rebalances"]
+        }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts to compare")
+    parser.add_argument("--chats", type=int, default=200, help="concurrent games")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of play per worker count")
+    parser.add_argument("--round-time", type=int, default=5, help="round duration in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Bot API latency in seconds")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for the bot's answer")
+    parser.add_argument("--live", action="store_true", help="edit the word card in place")
+    parser.add_argument("--scale-up", action="store_true", help="add a worker halfway through each run")
+    return parser.parse_args(argv)
+
+def main() -> None:
+    args = parse_args()
+    ensure_config()
+    quiet_logs()
+    print(f"cpu cores: {os.cpu_count()}, chats: {args.chats}, {args.duration:.0f}s per run")
+    baseline = None
+    for num_workers in (int(value) for value in args.workers.split(",")):
+        report = asyncio.run(ShardingBenchmark(args, num_workers).run())
+        rate = report["updates"] / report["elapsed"]
+        baseline = baseline or rate
+        print(f"workers: {num_workers} -> {report['workers']}  {rate:8.0f} updates/s  "
+              f"speedup {rate / baseline:4.2f}x  stalls: {report['stalls']}  rebalances: {report['rebalances']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+""" Memory per game: the old dict layout vs the slotted GameState.
+
+Run from the repository root:
+    python -m benchmarks.bench_state_memory [num_games]
+"""
+import sys
+import random
+import tracemalloc
+from data.loaders import get_pack
+from game.deck import GameDeck, RoundDeck
+from game.state import GameState
+from utils.logger import LOGGER
+
+
+def old_game_state(pack, num_teams, round_words):
+    """ Layout of the former DEFAULT_GAME_STATE dict, with its own containers """
+    teams = [{'name': f'Team {i+1}', 'score': 0} for i in range(num_teams)]
+    return {
+        'in_game': True,
+        'language': 'en',
+        'teams': teams,
+        'current_team_index': 0,
+        'round_time': 60,
+        'words_to_win': 15,
+        'round_active': True,
+        'round_deck': RoundDeck(GameDeck(pack)),
+        'explained_words_count': len(round_words),
+        'skipped_words_count': 0,
+        'explained_words': list(round_words),
+        'skipped_words': [],
+        'round_timer_message_id': 1,
+        'timer_start_time': 0.0,
+        'difficulty': 'easy',
+        'pack_id': pack.pack_id,
+        'total_scores': {team['name']: 0 for team in teams}
+    }
+
+def new_game_state(pack, num_teams, round_words):
+    game_state = GameState(language='en')
+    game_state.set_pack('easy')
+    game_state.set_teams(num_teams)
+    game_state.start_game(15)
+    game_state.prepare_round(pack)
+    game_state.start_round(0.0)
+    game_state.round.timer_message_id = 1
+    game_state.round.explained_words.extend(round_words)
+    return game_state
+
+def measure(factory, pack, num_games):
+    random.seed(0)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    games = {
+        chat_id: factory(pack, random.randint(2, 4), [pack[i] for i in random.sample(range(len(pack)), 10)])
+        for chat_id in range(num_games)
+    }
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del games
+    return (after - before) / num_games
+
+def main():
+    num_games = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    pack = get_pack('en_easy', LOGGER)
+
+    old_bytes = measure(old_game_state, pack, num_games)
+    new_bytes = measure(new_game_state, pack, num_games)
+    print(f"games: {num_games}")
+    print(f"dict layout:      {old_bytes:8.0f} bytes/game")
+    print(f"GameState layout: {new_bytes:8.0f} bytes/game ({new_bytes / old_bytes:.0%})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+""" Offline stand-ins for the Telegram Bot API used by the benchmarks.
+
+FakeRequest replaces the HTTP layer of a real Application, so the real
+handlers, filters and job queue run unchanged while every Bot API call is
+answered locally after a configurable latency.
+"""
+import sys
+import json
+import types
+import random
+import asyncio
+import itertools
+from collections import Counter
+from telegram.request import BaseRequest
+from utils.metrics import count_api_call, count_api_error
+from utils.ratelimit import TokenBucket
+
+
+FAKE_TOKEN = "123456:fake-token-for-offline-benchmarks"
+FLOOD_LIMITED = ("sendMessage", "editMessageText", "deleteMessage")
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "TalkFast", "username": "talkfast_bot"}
+
+
+def ensure_config(**overrides) -> None:
+    """ The benchmarks run without config.py, provide a stand-in token.
+    `overrides` replace settings of a stand-in or a real config """
+    try:
+        import config # noqa: F401
+    except ImportError:
+        config = types.ModuleType("config")
+        config.BOT_TOKEN = FAKE_TOKEN
+        config.STATE_STORE = "memory"
+        config.METRICS_LOG_INTERVAL = 0
+        sys.modules["config"] = config
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+
+class FakeRequest(BaseRequest):
+    """ Answers Bot API calls locally after `latency` (+ random `jitter`) seconds.
+    With a `flood_rate`, chat messages above that many per second are refused
+    with 429 and retry_after like Telegram's flood control. Calls and refusals
+    are counted in the bot metrics like CountingRequest does """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_rate: float = 0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.flood = TokenBucket(flood_rate, flood_rate) if flood_rate else None
+        self.calls = Counter()
+        self.message_ids = itertools.count(1000)
+        # chat_id -> {message_id: [callback_data, ...]}, oldest message first
+        self.keyboards = {}
+
+    @property
+    def read_timeout(self) -> float:
+        return 5.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs) -> tuple:
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        count_api_call(endpoint)
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        if self.flood is not None and endpoint in FLOOD_LIMITED and not self.flood.consume():
+            self.calls['flood_refused'] += 1
+            count_api_error(endpoint, "http_429")
+            return 429, json.dumps({
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            }).encode()
+        parameters = request_data.parameters if request_data is not None else {}
+        result = self.answer(endpoint, parameters)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def answer(self, endpoint: str, parameters: dict):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint in ("sendMessage", "editMessageText"):
+            chat_id = int(parameters["chat_id"])
+            message_id = int(parameters.get("message_id") or next(self.message_ids))
+            self.track_keyboard(chat_id, message_id, parameters.get("reply_markup"))
+            return {
+                "message_id": message_id,
+                "date": 0,
+                "chat": {"id": chat_id, "type": "group"},
+                "from": BOT_USER,
+                "text": parameters.get("text", "")
+            }
+        if endpoint == "deleteMessage":
+            self.keyboards.get(int(parameters["chat_id"]), {}).pop(int(parameters["message_id"]), None)
+        return True
+
+    def track_keyboard(self, chat_id: int, message_id: int, reply_markup) -> None:
+        keyboards = self.keyboards.setdefault(chat_id, {})
+        keyboards.pop(message_id, None)
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        if reply_markup and "inline_keyboard" in reply_markup:
+            keyboards[message_id] = [button["callback_data"] for row in reply_markup["inline_keyboard"] for button in row]
+
+    def find_button(self, chat_id: int, prefix: str) -> tuple:
+        """ (message_id, callback_data) of the newest button starting with `prefix` """
+        for message_id, buttons in reversed(self.keyboards.get(chat_id, {}).items()):
+            matching = [data for data in buttons if data.startswith(prefix)]
+            if matching:
+                return message_id, random.choice(matching)
+        return None, None
+
+
+class UpdateFactory:
+    """ Builds raw update dicts the way Telegram sends them """
+
+    def __init__(self) -> None:
+        self.update_ids = itertools.count(1)
+
+    @staticmethod
+    def chat(chat_id: int) -> dict:
+        return {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"}
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Player {user_id}"}
+
+    def message(self, chat_id: int, user_id: int, text: str) -> dict:
+        update_id = next(self.update_ids)
+        message = {
+            "message_id": update_id,
+            "date": 0,
+            "chat": self.chat(chat_id),
+            "from": self.user(user_id),
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, chat_id: int, user_id: int, message_id: int, data: str) -> dict:
+        update_id = next(self.update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self.user(user_id),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": 0,
+                    "chat": self.chat(chat_id),
+                    "from": BOT_USER,
+                    "text": ""
+                }
+            }
+        }
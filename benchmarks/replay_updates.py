@@ -0,0 +1,75 @@
+""" Replay recorded updates (JSON lines) against a running webhook.
+
+Updates are recorded by setting WEBHOOK_RECORD_PATH in config.py. Run from
+the repository root:
+    python -m benchmarks.replay_updates updates.jsonl --url http://127.0.0.1:8443/telegram --secret s3cret
+"""
+import sys
+import copy
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import httpx
+
+
+def shift_chat(update: dict, offset: int) -> dict:
+    """ Copy of the update moved to another chat, to simulate more games """
+    update = copy.deepcopy(update)
+    for key in ('message', 'callback_query'):
+        if key not in update:
+            continue
+        message = update[key].get('message', update[key])
+        message['chat']['id'] += offset
+    return update
+
+async def replay(updates, url, secret, concurrency):
+    latencies = []
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async def worker(client):
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.post(url, json=update, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                print(f"update {update.get('update_id')}: HTTP {response.status_code}", file=sys.stderr)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient() as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="recorded updates, one JSON object per line")
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', default=None)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--chats', type=int, default=1, help="replay the recording in this many chats")
+    args = parser.parse_args()
+
+    with open(args.path, encoding='utf-8') as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+
+    update_ids = itertools.count(1)
+    updates = []
+    for chat in range(args.chats):
+        for update in recorded:
+            update = shift_chat(update, chat * 1_000_000) if chat else copy.deepcopy(update)
+            update['update_id'] = next(update_ids)
+            updates.append(update)
+
+    latencies, elapsed = asyncio.run(replay(updates, args.url, args.secret, args.concurrency))
+    latencies.sort()
+    print(f"updates: {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} updates/s)")
+    print(f"latency p50: {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
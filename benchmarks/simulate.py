@@ -0,0 +1,228 @@
+""" Offline load simulation: thousands of chats playing against the real handlers.
+
+Every chat goes through /start, the language and difficulty buttons, the
+text setup and then plays rounds by pressing the word buttons. The Bot API
+is answered by benchmarks.fakes.FakeRequest, nothing leaves the machine.
+Run from the repository root:
+    python -m benchmarks.simulate --chats 1000 --rounds 2 --latency 0.05
+    python -m benchmarks.simulate --chats 100 --flood-rate 30 --rate 30   # under flood control
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+from collections import defaultdict
+from benchmarks.fakes import FakeRequest, UpdateFactory, ensure_config
+
+ensure_config()
+logging.getLogger("apscheduler").setLevel(logging.WARNING) # one line per job run otherwise
+
+from telegram import Update # noqa: E402
+import run_bot # noqa: E402
+from game.timer import TIMERS # noqa: E402
+from game.state import GAME_STATES # noqa: E402
+from data.loaders import preload_packs # noqa: E402
+from utils.logger import LOGGER # noqa: E402
+from utils.metrics import summary # noqa: E402
+from utils.outbox import OUTBOX # noqa: E402
+from utils.profiler import SamplingProfiler # noqa: E402
+
+
+def rss_bytes() -> int:
+    """ Current resident set size, peak RSS where /proc is not available """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def update_kind(data: dict) -> str:
+    if "callback_query" in data:
+        return "button " + data["callback_query"]["data"].split(":")[0]
+    text = data["message"]["text"]
+    return text.split()[0] if text.startswith("/") else "text"
+
+
+class Simulation:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.fake = FakeRequest(latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate)
+        self.factory = UpdateFactory()
+        self.latencies = defaultdict(list)
+        self.tick_durations = []
+        self.errors = 0
+        self.stuck = [] # chats that didn't finish their rounds within --chat-timeout
+        self.application = None
+        self.profiler = SamplingProfiler(args.profile) if args.profile else None
+
+    async def process(self, data: dict) -> None:
+        update = Update.de_json(data, self.application.bot)
+        started = time.perf_counter()
+        # through the update processor, like updates fetched by the application
+        await self.application.update_processor.process_update(update, self.application.process_update(update))
+        self.latencies[update_kind(data)].append(time.perf_counter() - started)
+
+    async def press(self, chat_id: int, prefix: str) -> bool:
+        """ Press the newest button starting with `prefix` in the chat """
+        message_id, data = self.fake.find_button(chat_id, prefix)
+        if message_id is None:
+            return False
+        await self.process(self.factory.callback(chat_id, chat_id, message_id, data))
+        return True
+
+    async def play_chat(self, chat_id: int) -> None:
+        """ One game, a chat that doesn't finish in time is reported as stuck """
+        try:
+            await asyncio.wait_for(self.play_rounds(chat_id), self.args.chat_timeout)
+        except asyncio.TimeoutError:
+            self.stuck.append(chat_id)
+            LOGGER.error(f"Chat {chat_id} is stuck: its rounds did not finish within {self.args.chat_timeout}s")
+        await self.process(self.factory.message(chat_id, chat_id, "/cancel"))
+
+    async def play_rounds(self, chat_id: int) -> None:
+        args = self.args
+        await self.process(self.factory.message(chat_id, chat_id, "/start"))
+        await self.press(chat_id, "start_game")
+        await self.press(chat_id, "set_lang_")
+        await self.press(chat_id, "set_difficulty_")
+        for text in ("2", "Red", "Blue", str(args.round_time), "100000"):
+            await self.process(self.factory.message(chat_id, chat_id, text))
+
+        rounds = 0
+        while True:
+            await asyncio.sleep(args.think * (0.5 + random.random()))
+            if self.fake.find_button(chat_id, "start_next_round")[0] is not None:
+                rounds += 1
+                if rounds >= args.rounds:
+                    break
+                await self.press(chat_id, "start_next_round")
+            else:
+                await self.press(chat_id, "word_")
+
+    async def count_error(self, update: object, context) -> None:
+        self.errors += 1
+        LOGGER.debug(f"Handler error: {context.error}")
+
+    def measure_ticks(self) -> None:
+        tick = TIMERS.tick
+
+        async def measured_tick(context):
+            started = time.perf_counter()
+            await tick(context)
+            self.tick_durations.append(time.perf_counter() - started)
+        TIMERS.tick = measured_tick
+
+    async def run(self) -> dict:
+        args = self.args
+        run_bot.LIVE_WORD_CARD = args.live
+        run_bot.ROUND_COUNTDOWN = args.countdown
+        preload_packs(LOGGER)
+        self.measure_ticks()
+        if self.profiler is not None:
+            self.profiler.start()
+        self.application = run_bot.build_application(
+            request=self.fake, metrics_port=args.metrics_port, profiler=self.profiler
+        )
+        self.application.add_error_handler(self.count_error)
+        OUTBOX.set_limits(args.rate, args.chat_rate, args.chat_rate * 2)
+
+        rss_before = rss_bytes()
+        async with self.application:
+            await self.application.start()
+            started = time.perf_counter()
+            chats = [self.play_chat(chat_id) for chat_id in range(1, args.chats + 1)]
+            await asyncio.gather(*chats)
+            elapsed = time.perf_counter() - started
+            if self.profiler is not None:
+                self.profiler.stop()
+            await self.application.stop()
+        rss_after = rss_bytes()
+
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        updates = len(all_latencies)
+        return {
+            "elapsed": elapsed,
+            "updates": updates,
+            "errors": self.errors,
+            "stuck": sorted(self.stuck),
+            "api_calls": sum(self.fake.calls.values()) - self.fake.calls['flood_refused'], # counted under their method too
+            "api_calls_by_method": dict(self.fake.calls.most_common()),
+            "latency": {
+                kind: (len(values), percentile(values, 0.5), percentile(values, 0.99))
+                for kind, values in sorted(self.latencies.items())
+            },
+            "p50": percentile(all_latencies, 0.5),
+            "p99": percentile(all_latencies, 0.99),
+            "ticks": self.tick_durations,
+            "rss_before": rss_before,
+            "rss_after": rss_after,
+            "games_left": len(GAME_STATES),
+            "metrics": summary(),
+            "hot_functions": self.profiler.hot_functions() if self.profiler is not None else []
+        }
+
+
+def print_report(report: dict) -> None:
+    updates = report["updates"]
+    ticks = report["ticks"]
+    print(f"updates: {updates} in {report['elapsed']:.1f}s ({updates / report['elapsed']:.0f} updates/s), "
+          f"handler errors: {report['errors']}, stuck chats: {len(report['stuck'])}")
+    if report["stuck"]:
+        print(f"  stuck: {', '.join(map(str, report['stuck'][:20]))}{' ...' if len(report['stuck']) > 20 else ''}")
+    print(f"handler latency p50: {report['p50'] * 1000:.2f} ms, p99: {report['p99'] * 1000:.2f} ms")
+    for kind, (count, p50, p99) in report["latency"].items():
+        print(f"  {kind:<24} {count:>8}  p50 {p50 * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms")
+    print(f"api calls: {report['api_calls']} ({report['api_calls'] / max(updates, 1):.2f} per update)")
+    for method, count in report["api_calls_by_method"].items():
+        print(f"  {method:<24} {count:>8}")
+    if ticks:
+        print(f"timer ticks: {len(ticks)}, avg {sum(ticks) / len(ticks) * 1000:.2f} ms, "
+              f"max {max(ticks) * 1000:.2f} ms")
+    growth = report["rss_after"] - report["rss_before"]
+    print(f"rss: {report['rss_before'] / 2**20:.1f} MiB -> {report['rss_after'] / 2**20:.1f} MiB "
+          f"({growth / 2**20:+.1f} MiB), games left in memory: {report['games_left']}")
+    print(f"bot metrics:\n{report['metrics']}")
+    if report["hot_functions"]:
+        print("hot frames of the event loop thread:")
+        for frame, share in report["hot_functions"]:
+            print(f"  {share * 100:5.1f}%  {frame}")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200, help="concurrent games")
+    parser.add_argument("--rounds", type=int, default=2, help="rounds played per game")
+    parser.add_argument("--round-time", type=int, default=5, help="round duration in seconds")
+    parser.add_argument("--countdown", type=float, default=0.5, help="'get ready' delay in seconds")
+    parser.add_argument("--think", type=float, default=0.2, help="average pause between presses")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Bot API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency in seconds")
+    parser.add_argument("--live", action="store_true", help="edit the word card in place")
+    parser.add_argument("--flood-rate", type=float, default=0, help="fake flood control: messages per second before 429")
+    parser.add_argument("--rate", type=float, default=0, help="outbox budget per second, 0 means no limit")
+    parser.add_argument("--chat-rate", type=float, default=0, help="outbox budget per chat and second")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve /metrics while running")
+    parser.add_argument("--profile", type=float, default=0, help="sampling profiler interval in seconds")
+    parser.add_argument("--chat-timeout", type=float, default=120, help="seconds a chat may take for its rounds before it counts as stuck")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+def main() -> None:
+    args = parse_args()
+    random.seed(args.seed)
+    report = asyncio.run(Simulation(args).run())
+    print_report(report)
+    if report["stuck"]:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+""" Compile data/words/*_words.json into the memory-mapped .pack format.
+
+The bot loads a compiled pack instead of the JSON whenever the .pack file
+is at least as new as the JSON. Run from the repository root after editing
+a pack:
+    python -m data.build_packs            # every pack in data/words
+    python -m data.build_packs en_easy    # only the given packs
+    python -m data.build_packs --check    # fail if a compiled pack is stale
+    python -m data.build_packs --validate # fail if a word doesn't render as MarkdownV2
+
+Packs whose words don't render are never compiled.
+"""
+import os
+import sys
+import json
+import glob
+import argparse
+import tempfile
+from data.loaders import WORDS_DIR, WordPack, get_pack_path, get_compiled_pack_path
+from data.packfile import BinaryWordPack, compile_pack, content_hash
+from game.render import markdown_v2_errors, summary_line, word_card
+
+
+def find_pack_ids() -> list:
+    suffix = "_words.json"
+    return sorted(os.path.basename(path)[:-len(suffix)] for path in glob.glob(os.path.join(WORDS_DIR, "*" + suffix)))
+
+def read_entries(pack_id: str) -> list:
+    with open(get_pack_path(pack_id), 'r', encoding='utf-8') as f:
+        return list(json.load(f).items())
+
+def render_errors(pack_id: str, entries: list) -> list:
+    """ [(word, error)] for every word card or summary line Telegram would reject """
+    pack = WordPack(pack_id, tuple(entries), 0.0)
+    errors = []
+    for index, (word, _) in enumerate(entries):
+        texts = (word_card(pack, index), summary_line(True, *pack.display(index)), summary_line(False, *pack.display(index)))
+        for text in texts:
+            errors += [(word, error) for error in markdown_v2_errors(text)]
+    return errors
+
+def build_pack(pack_id: str) -> int:
+    """ Compile one pack, returns the size of the written file """
+    entries = read_entries(pack_id)
+    data = compile_pack(entries)
+    target = get_compiled_pack_path(pack_id)
+    # write next to the target and swap it in: running bots keep their mapping of the old file
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, target)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return len(data)
+
+def is_up_to_date(pack_id: str) -> bool:
+    try:
+        pack = BinaryWordPack(pack_id, get_compiled_pack_path(pack_id), 0.0)
+    except (OSError, ValueError):
+        return False
+    return pack.content_hash == content_hash(read_entries(pack_id))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pack_ids", nargs="*", help="packs to compile, e.g. en_easy; all by default")
+    parser.add_argument("--check", action="store_true", help="only verify that the compiled packs are current")
+    parser.add_argument("--validate", action="store_true", help="only verify that every word renders")
+    args = parser.parse_args()
+
+    pack_ids = args.pack_ids or find_pack_ids()
+    invalid = []
+    for pack_id in pack_ids:
+        entries = read_entries(pack_id)
+        errors = render_errors(pack_id, entries)
+        for word, error in errors:
+            print(f"{pack_id}: {word!r} doesn't render, {error}")
+        if errors:
+            invalid.append(pack_id)
+        elif args.validate:
+            print(f"{pack_id}: {len(entries)} words render")
+    if args.validate or invalid:
+        sys.exit(1 if invalid else 0)
+
+    if args.check:
+        stale = [pack_id for pack_id in pack_ids if not is_up_to_date(pack_id)]
+        for pack_id in stale:
+            print(f"{pack_id}: compiled pack is missing or stale")
+        sys.exit(1 if stale else 0)
+
+    for pack_id in pack_ids:
+        size = build_pack(pack_id)
+        print(f"{pack_id}: {size} bytes -> {get_compiled_pack_path(pack_id)}")
+
+if __name__ == '__main__':
+    main()
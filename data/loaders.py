@@ -1,11 +1,132 @@
+import os
+import sys
 import json
+import threading
+from data.packfile import BinaryWordPack, content_hash, escape
 
 
+WORDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "words")
+LANGUAGES = ("de", "en")
+DIFFICULTIES = ("easy", "medium", "hard")
+
+
+class WordPack:
+    """ Immutable word pack shared by all games: ((word, translation), ...)
+
+    The MarkdownV2 forms are escaped once here, like the compiled packs
+    store them, so rendering a word never escapes again.
+    """
+    __slots__ = ("pack_id", "entries", "displays", "mtime", "content_hash")
+
+    def __init__(self, pack_id: str, entries: tuple, mtime: float) -> None:
+        object.__setattr__(self, "pack_id", pack_id)
+        object.__setattr__(self, "entries", entries)
+        object.__setattr__(self, "displays", tuple(
+            (sys.intern(escape(word)), sys.intern(escape(translation))) for word, translation in entries
+        ))
+        object.__setattr__(self, "mtime", mtime)
+        object.__setattr__(self, "content_hash", content_hash(entries))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("WordPack is immutable")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, index: int) -> tuple:
+        return self.entries[index]
+
+    def display(self, index: int) -> tuple:
+        """ (word, translation) escaped for MarkdownV2 """
+        return self.displays[index]
+
+
+# Global registry: pack_id -> WordPack. Games keep only the pack_id.
+WORD_PACKS = {}
+_PACKS_LOCK = threading.Lock()
+
+
+def get_pack_id(language, difficulty):
+    return f"{language}_{difficulty}"
+
+def get_pack_path(pack_id):
+    return os.path.join(WORDS_DIR, f"{pack_id}_words.json")
+
+def get_compiled_pack_path(pack_id):
+    """ Output of `python -m data.build_packs` for the pack """
+    return os.path.join(WORDS_DIR, f"{pack_id}_words.pack")
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def get_pack_source(pack_id):
+    """ (path, mtime) of the file to load: the compiled pack unless the JSON is newer """
+    json_path, compiled_path = get_pack_path(pack_id), get_compiled_pack_path(pack_id)
+    json_mtime, compiled_mtime = _mtime(json_path), _mtime(compiled_path)
+    if compiled_mtime is not None and (json_mtime is None or compiled_mtime >= json_mtime):
+        return compiled_path, compiled_mtime
+    return json_path, json_mtime or 0.0
+
 def load_words(language, difficulty, logger):
-    path_to_file = f"data/words/{language}_{difficulty}_words.json"
+    """ Read a raw pack file from disk. Prefer get_pack() in the game code """
+    path_to_file = get_pack_path(get_pack_id(language, difficulty))
     try:
         with open(path_to_file, 'r', encoding='utf-8') as f:
             return json.load(f)
     except FileNotFoundError:
         logger.error(f"No file with the words found: {path_to_file}")
-        return []
\ No newline at end of file
+        return {}
+
+def _build_pack(pack_id, logger):
+    path, mtime = get_pack_source(pack_id)
+    if path.endswith(".pack"):
+        try:
+            return BinaryWordPack(pack_id, path, mtime)
+        except (OSError, ValueError) as e:
+            logger.error(f"Compiled word pack {path} can't be used, reading the JSON: {e}")
+            mtime = _mtime(get_pack_path(pack_id)) or 0.0
+
+    language, difficulty = pack_id.split('_', 1)
+    words = load_words(language, difficulty, logger)
+    entries = tuple(
+        (sys.intern(word), sys.intern(translation)) for word, translation in words.items()
+    )
+    return WordPack(pack_id, entries, mtime)
+
+def get_pack(pack_id, logger):
+    """ Return the shared pack, loading it on first use """
+    pack = WORD_PACKS.get(pack_id)
+    if pack is None:
+        with _PACKS_LOCK:
+            pack = WORD_PACKS.get(pack_id)
+            if pack is None:
+                pack = _build_pack(pack_id, logger)
+                WORD_PACKS[pack_id] = pack
+                logger.info(f"Word pack {pack_id} loaded: {len(pack)} words")
+    return pack
+
+def preload_packs(logger):
+    """ Load every shipped pack once at startup """
+    for language in LANGUAGES:
+        for difficulty in DIFFICULTIES:
+            get_pack(get_pack_id(language, difficulty), logger)
+
+def reload_pack(pack_id, logger):
+    """ Re-read one pack from disk. Running rounds keep the old object """
+    pack = _build_pack(pack_id, logger)
+    with _PACKS_LOCK:
+        WORD_PACKS[pack_id] = pack
+    logger.info(f"Word pack {pack_id} reloaded: {len(pack)} words")
+    return pack
+
+def reload_changed_packs(logger):
+    """ Reload only the packs whose file changed on disk since loading """
+    reloaded = []
+    for pack_id, pack in list(WORD_PACKS.items()):
+        if get_pack_source(pack_id)[1] != pack.mtime:
+            reload_pack(pack_id, logger)
+            reloaded.append(pack_id)
+    return reloaded
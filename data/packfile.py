@@ -0,0 +1,121 @@
+""" Compiled word pack format (.pack), written by data/build_packs.py.
+
+All integers are little-endian:
+
+    header   magic b"AWP1", version u16, fields u16, count u32, content hash 16 bytes
+    offsets  u32[count * fields + 1], start of every string in the blob
+    blob     UTF-8 strings, per word: word, translation, and both escaped for MarkdownV2
+
+Field f of word i spans blob[offsets[i * fields + f]:offsets[i * fields + f + 1]].
+"""
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+from telegram.helpers import escape_markdown
+
+
+MAGIC = b"AWP1"
+VERSION = 1
+FIELDS = 4 # word, translation, word_md, translation_md
+HEADER = struct.Struct("<4sHHI16s")
+
+
+def escape(text: str) -> str:
+    """ Text safe to put into a MarkdownV2 message """
+    return escape_markdown(text, version=2)
+
+def content_hash(entries) -> bytes:
+    """ Hash of ((word, translation), ...) identifying a pack's content and order """
+    digest = hashlib.blake2b(digest_size=16)
+    for word, translation in entries:
+        digest.update(word.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(translation.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.digest()
+
+def compile_pack(entries) -> bytes:
+    """ Binary pack of ((word, translation), ...) """
+    entries = list(entries)
+    offsets = array('I', [0])
+    blob = bytearray()
+    for word, translation in entries:
+        for text in (word, translation, escape(word), escape(translation)):
+            blob += text.encode('utf-8')
+            offsets.append(len(blob))
+    if len(blob) > 0xFFFFFFFF:
+        raise ValueError("Word pack is too large for 32 bit offsets")
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    header = HEADER.pack(MAGIC, VERSION, FIELDS, len(entries), content_hash(entries))
+    return header + offsets.tobytes() + bytes(blob)
+
+
+class BinaryWordPack:
+    """ Memory-mapped compiled pack: words are decoded only when requested,
+    the pages of the file are shared between all processes using it """
+    __slots__ = ("pack_id", "mtime", "content_hash", "_buffer", "_offsets", "_blob", "_count")
+
+    def __init__(self, pack_id: str, path: str, mtime: float) -> None:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, fields, count, digest = HEADER.unpack_from(buffer)
+        except struct.error:
+            buffer.close()
+            raise ValueError(f"Compiled word pack is truncated: {path}")
+        if magic != MAGIC or version != VERSION or fields != FIELDS:
+            buffer.close()
+            raise ValueError(f"Not a compiled word pack: {path}")
+
+        offsets_end = HEADER.size + (count * FIELDS + 1) * 4
+        if len(buffer) < offsets_end:
+            buffer.close()
+            raise ValueError(f"Compiled word pack is truncated: {path}")
+        view = memoryview(buffer)
+        if sys.byteorder == 'little':
+            offsets = view[HEADER.size:offsets_end].cast('I')
+        else:
+            offsets = array('I', view[HEADER.size:offsets_end])
+            offsets.byteswap()
+        # the last offset is the end of the blob, a truncated or padded file would return wrong words
+        if offsets[0] != 0 or offsets[-1] != len(buffer) - offsets_end:
+            if isinstance(offsets, memoryview):
+                offsets.release()
+            view.release()
+            buffer.close()
+            raise ValueError(f"Compiled word pack is truncated or corrupt: {path}")
+
+        set_field = object.__setattr__
+        set_field(self, "pack_id", pack_id)
+        set_field(self, "mtime", mtime)
+        set_field(self, "content_hash", digest)
+        set_field(self, "_buffer", buffer)
+        set_field(self, "_offsets", offsets)
+        set_field(self, "_blob", view[offsets_end:])
+        set_field(self, "_count", count)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BinaryWordPack is immutable")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _fields(self, index: int, first: int) -> tuple:
+        if not 0 <= index < self._count:
+            raise IndexError("word index out of range")
+        offsets = self._offsets
+        position = index * FIELDS + first
+        start, middle, end = offsets[position], offsets[position + 1], offsets[position + 2]
+        blob = self._blob
+        return str(blob[start:middle], 'utf-8'), str(blob[middle:end], 'utf-8')
+
+    def __getitem__(self, index: int) -> tuple:
+        """ (word, translation) """
+        return self._fields(index, 0)
+
+    def display(self, index: int) -> tuple:
+        """ (word, translation) escaped for MarkdownV2 """
+        return self._fields(index, 2)
@@ -0,0 +1,213 @@
+import random
+from array import array
+
+
+ROUND_SIZE = 50 # words dealt per round, refilled if the team is that fast
+DRAW_ATTEMPTS = 8 # weighted draws per dealt word before the shuffled one is taken
+
+
+def index_array(values=(), pack_size: int = 0) -> array:
+    """ Compact array of pack indices: 2 bytes per word for packs below 64k words """
+    return array('H' if pack_size <= 0xFFFF else 'I', values)
+
+
+class AliasTable:
+    """ Walker's alias table: draws an index with probability weights[i] / sum(weights)
+    in O(1), building it is O(n). Shared by all games dealing from one pack """
+    __slots__ = ("probability", "alias")
+
+    def __init__(self, weights) -> None:
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights] if total > 0 else [1.0] * count
+        self.probability = array('d', [1.0]) * count # columns left over at the end keep 1
+        self.alias = index_array(range(count), count)
+        small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+        while small and large:
+            low, high = small.pop(), large[-1]
+            self.probability[low] = scaled[low]
+            self.alias[low] = high
+            scaled[high] -= 1.0 - scaled[low]
+            if scaled[high] < 1.0:
+                small.append(large.pop())
+
+    def __len__(self) -> int:
+        return len(self.alias)
+
+    def draw(self) -> int:
+        column = random.random() * len(self.alias)
+        index = int(column)
+        return index if column - index < self.probability[index] else self.alias[index]
+
+
+class GameDeck:
+    """ Per-game permutation of a shared pack, dealt across rounds without repeats.
+
+    order[:cursor] has been dealt, order[cursor:] is still in the deck. The
+    pack is shuffled once per game and again only when the deck runs out.
+    A weighted deal draws the next words from a sampler instead and swaps
+    them to the top of the deck, `positions` (the inverse of `order`) is
+    only built for that.
+    """
+    __slots__ = ("pack", "order", "cursor", "round_start", "positions", "saved")
+
+    def __init__(self, pack) -> None:
+        self.pack = pack
+        self.order = index_array(range(len(pack)), len(pack))
+        random.shuffle(self.order)
+        self.cursor = 0
+        self.round_start = 0 # where the current round started dealing
+        self.positions = None # pack index -> place in order, built by the first weighted deal
+        self.saved = False # the store holds this order, see GameState.deck_snapshot()
+
+    def __len__(self) -> int:
+        return len(self.order) - self.cursor
+
+    def reshuffle(self) -> None:
+        random.shuffle(self.order)
+        self.cursor = 0
+        self.round_start = 0
+        self.positions = None
+
+    def start_round(self) -> None:
+        self.round_start = self.cursor
+
+    def deal(self, size: int, sampler: AliasTable = None) -> array:
+        """ Up to `size` next indices, reshuffles first if the deck is empty.
+        With a sampler of the pack the words are drawn by its weights """
+        if not self.order:
+            raise IndexError("Word pack is empty")
+        if self.cursor >= len(self.order):
+            self.reshuffle()
+        self.saved = False
+        if sampler is not None and len(sampler) == len(self.order):
+            self._draw(size, sampler)
+        dealt = self.order[self.cursor:self.cursor + size]
+        self.cursor += len(dealt)
+        return dealt
+
+    def _draw(self, size: int, sampler: AliasTable) -> None:
+        """ Move words drawn from the sampler to the top of the deck. A draw of an
+        already dealt word is repeated, after DRAW_ATTEMPTS the shuffled word stays """
+        if self.positions is None:
+            self.positions = self._build_positions()
+        positions = self.positions
+        for place in range(self.cursor, min(self.cursor + size, len(self.order))):
+            for _ in range(DRAW_ATTEMPTS):
+                index = sampler.draw()
+                if positions[index] >= place:
+                    self._swap(place, positions[index])
+                    break
+
+    def _build_positions(self) -> array:
+        positions = index_array(self.order, len(self.order))
+        for place, index in enumerate(self.order):
+            positions[index] = place
+        return positions
+
+    def _swap(self, first: int, second: int) -> None:
+        """ Swap two places of the deck, keeping `positions` up to date """
+        order = self.order
+        order[first], order[second] = order[second], order[first]
+        if self.positions is not None:
+            self.positions[order[first]] = first
+            self.positions[order[second]] = second
+
+    def put_back(self, indices) -> None:
+        """ Return words dealt in this round to random places of the deck """
+        order = self.order
+        self.saved = False
+        for index in indices:
+            try:
+                position = order.index(index, self.round_start, self.cursor)
+            except ValueError:
+                continue # dealt before a reshuffle, it is back in the deck anyway
+            last = self.cursor - 1
+            self._swap(position, last)
+            self.cursor = last
+            self._swap(last, random.randrange(last, len(order)))
+
+    def to_dict(self) -> dict:
+        return {
+            'pack_id': self.pack.pack_id,
+            'pack_hash': self.pack.content_hash.hex(),
+            'order': self.order.tolist(),
+            'cursor': self.cursor,
+            'round_start': self.round_start
+        }
+
+    @classmethod
+    def from_dict(cls, pack, data: dict) -> "GameDeck":
+        if data.get('pack_hash', pack.content_hash.hex()) != pack.content_hash.hex() or len(data['order']) != len(pack):
+            return cls(pack) # the pack changed on disk since the snapshot
+        deck = cls.__new__(cls)
+        deck.pack = pack
+        deck.order = index_array(data['order'], len(pack))
+        deck.cursor = data['cursor']
+        deck.round_start = data['round_start']
+        deck.positions = None
+        deck.saved = False # written once more, older snapshots kept it with the game
+        return deck
+
+
+class RoundDeck:
+    """ Words of one round: indices dealt from the game deck with a cursor """
+    __slots__ = ("source", "indices", "cursor", "skipped")
+
+    def __init__(self, source: GameDeck, size: int = ROUND_SIZE, sampler: AliasTable = None) -> None:
+        self.source = source
+        source.start_round()
+        self.indices = source.deal(size, sampler)
+        self.cursor = 0
+        self.skipped = index_array((), len(source.pack))
+
+    @property
+    def pack(self):
+        return self.source.pack
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, position: int) -> tuple:
+        return self.source.pack[self.indices[position]]
+
+    def current_index(self) -> int:
+        """ Pack index of the word under the cursor """
+        if self.cursor >= len(self.indices):
+            self.refill()
+        return self.indices[self.cursor]
+
+    def current(self) -> tuple:
+        """ (word, translation) under the cursor """
+        return self.source.pack[self.current_index()]
+
+    def advance(self) -> None:
+        self.cursor += 1
+
+    def skip(self) -> None:
+        """ Remember the word under the cursor, it goes back to the deck """
+        self.skipped.append(self.indices[self.cursor])
+
+    def refill(self, size: int = ROUND_SIZE) -> None:
+        """ Deal more words from the game deck """
+        self.indices.extend(self.source.deal(size))
+
+    def finish(self) -> None:
+        """ Give the unplayed and the skipped words back to the game deck """
+        self.source.put_back(self.indices[self.cursor:])
+        self.source.put_back(self.skipped)
+
+    def to_dict(self) -> dict:
+        return {'indices': self.indices.tolist(), 'cursor': self.cursor, 'skipped': self.skipped.tolist()}
+
+    @classmethod
+    def from_dict(cls, source: GameDeck, data: dict) -> "RoundDeck":
+        deck = cls.__new__(cls)
+        deck.source = source
+        size = len(source.pack)
+        # the pack may have changed on disk since the snapshot
+        deck.indices = index_array((i for i in data['indices'] if i < size), size)
+        deck.cursor = data['cursor']
+        deck.skipped = index_array((i for i in data['skipped'] if i < size), size)
+        return deck
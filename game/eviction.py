@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+from telegram import Update
+from telegram.ext import BaseHandler
+
+
+class GameEvictor:
+    """ Bounds the games kept in memory.
+
+    Chats are kept in least recently active order, so a sweep only looks at
+    the oldest entries: games idle for longer than `ttl` seconds are dropped,
+    then the least recently used ones while there are more than `max_games`.
+    A value of 0 turns the respective limit off.
+    """
+
+    def __init__(self, ttl: float, max_games: int) -> None:
+        self.ttl = ttl
+        self.max_games = max_games
+        self.chats = OrderedDict() # chat_id -> last activity, least recent first
+        self.counters = {'idle': 0, 'lru': 0, 'bytes': 0}
+
+    def touch(self, chat_id: int, now: float = None) -> None:
+        """ Activity of a chat with a game, chats without one must not be tracked """
+        self.chats[chat_id] = time.monotonic() if now is None else now
+        self.chats.move_to_end(chat_id)
+
+    def forget(self, chat_id: int) -> None:
+        self.chats.pop(chat_id, None)
+
+    def select(self, games: dict, busy, now: float = None) -> list:
+        """ [(chat_id, reason)] to drop; busy(chat_id) protects running rounds """
+        now = time.monotonic() if now is None else now
+        selected = []
+        excess = len(games) - self.max_games if self.max_games else 0
+        for chat_id, last_seen in list(self.chats.items()):
+            if chat_id not in games:
+                del self.chats[chat_id] # dropped without forget(), e.g. by a worker handing it over
+                continue
+            idle = self.ttl and now - last_seen > self.ttl
+            if not idle and excess <= 0:
+                break # the rest is more recent
+            if busy(chat_id):
+                self.touch(chat_id, now=now) # looked at again after the round
+                continue
+            selected.append((chat_id, 'idle' if idle else 'lru'))
+            excess -= 1
+        return selected
+
+    def stats(self) -> dict:
+        return {'tracked_chats': len(self.chats), **self.counters}
+
+
+class ExpiredGameHandler(BaseHandler):
+    """ Catches button presses of chats without a game, e.g. after the game
+    was evicted, before the game handlers see them. Setup answers need no
+    catching: a chat without a game has no setup step to answer """
+
+    def __init__(self, callback, has_game, free_buttons: tuple = ()) -> None:
+        super().__init__(callback)
+        self.has_game = has_game
+        self.free_buttons = free_buttons # buttons that work without a game
+
+    def check_update(self, update: object) -> bool:
+        if not isinstance(update, Update) or update.callback_query is None or update.effective_chat is None:
+            return False
+        if self.has_game(update.effective_chat.id):
+            return False
+        return update.callback_query.data not in self.free_buttons
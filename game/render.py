@@ -0,0 +1,140 @@
+""" MarkdownV2 texts of the game.
+
+Everything inserted into a message is escaped exactly once: pack entries
+when the pack is loaded (pack.display), team names on first use. Word
+cards are cached per pack entry.
+
+Game buttons carry a version in their callback_data, "action:token", see
+GameState.word_token. A press with any other token is stale.
+"""
+from functools import lru_cache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from data.packfile import escape
+
+
+CARD_CACHE_SIZE = 8192 # rendered word cards kept, about 100 bytes each
+WORD_LIST_LENGTH = 1400 # characters per word list of a round summary, two fit a message with the rest
+MAX_TEAM_NAME_LENGTH = 64 # UTF-16 units like text_length(), a name shows up a few times in a round summary
+
+
+def word_keyboard(token: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Understood", callback_data=f'word_explained:{token}')],
+        [InlineKeyboardButton("❌ Skip", callback_data=f'word_skipped:{token}')]
+    ])
+
+def next_round_keyboard(token: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Start the next round", callback_data=f'start_next_round:{token}')]
+    ])
+
+@lru_cache(maxsize=1024)
+def escaped(text: str) -> str:
+    """ User input such as team names, escaped for MarkdownV2 """
+    return escape(text)
+
+@lru_cache(maxsize=CARD_CACHE_SIZE)
+def word_card(pack, index: int) -> str:
+    word, translation = pack.display(index)
+    return f"📝📝📝 *{word}* 📝📝📝 \n\n" \
+           f"🌐 Translation: \\(_{translation}_\\)"
+
+def summary_line(explained: bool, word: str, translation: str) -> str:
+    """ One line of the round summary from already escaped strings """
+    return f"{'✅' if explained else '❌'} *{word}* \\(_{translation}_\\)"
+
+def round_start_text(team_name: str, round_time: int) -> str:
+    return (f"🚨 The round for team *{escaped(team_name)}* is starting\\! \n"
+            f"⏳ You have *{round_time}* seconds\\. \n\n"
+            f"🚀🚀🚀 *Get ready\\! 🚀🚀🚀*\n"
+            f"⬇️⬇️⬇️⬇️⬇️⬇️⬇️⬇️⬇️ \n")
+
+def text_length(text: str) -> int:
+    """ UTF-16 code units Telegram counts, an upper bound: the markup isn't subtracted """
+    return len(text.encode('utf-16-le')) // 2
+
+def fits(text: str) -> bool:
+    return text_length(text) <= MAX_MESSAGE_LENGTH
+
+def word_list(lines: list, budget: int = WORD_LIST_LENGTH) -> str:
+    """ Summary lines up to `budget` characters, the rest is only counted """
+    shown, used = [], 0
+    for line in lines:
+        used += text_length(line) + 1
+        if used > budget:
+            shown.append(f"… and {len(lines) - len(shown)} more")
+            break
+        shown.append(line)
+    return "\n".join(shown) or "—"
+
+def round_summary_text(team, round_state, score_this_round: int) -> str:
+    """ The summary lines were rendered while the round was played. Long
+    word lists are cut, so the summary leaves room for the other texts of
+    the round end in one message """
+    name = escaped(team.name)
+    explained_text = word_list(round_state.explained_lines)
+    skipped_text = word_list(round_state.skipped_lines)
+    return (f"⏹️ *Round for team* *{name}* *is over\\!* \n"
+            f"👍 *Words explained:* {round_state.explained_count} \n"
+            f"❌ *Words skipped:* {round_state.skipped_count} \n"
+            f"🏅 *Points this round:* {score_this_round} \n"
+            f"📊 *Total score for team* *{name}*: {team.score} \n\n"
+            f"*Explained words:* \n{explained_text}\n\n"
+            f"*Skipped words:* \n{skipped_text}")
+
+def win_text(team) -> str:
+    return (f"🏆 *WIN\\!\\!* 🎉\n\n"
+            f"Team *{escaped(team.name)}* reached *{team.score}* points and won the game\\! 🥳")
+
+def final_scores_text(teams) -> str:
+    lines = ["🏁 *Final Scoreboard* 🏁\n"]
+    lines += [f"👥 *{escaped(team.name)}*: *{team.score}* points 🏅" for team in teams]
+    lines.append("\n🥇 Congratulations to the winning team\\! 🎉")
+    return "\n".join(lines)
+
+def next_turn_text(team) -> str:
+    return f"🏃The next turn for team: *{escaped(team.name)}*"
+
+
+MAX_MESSAGE_LENGTH = 4096 # characters of text after entities parsing
+MARKDOWN_V2_SPECIAL = set("_*[]()~`>#+-=|{}.!")
+MARKDOWN_V2_ENTITIES = ("||", "__", "*", "_", "~") # the entity markers the game uses
+
+def markdown_v2_errors(text: str) -> list:
+    """ Why Telegram would reject `text` as MarkdownV2, empty if it would not.
+
+    Only the subset the game sends is understood: bold, italic, underline,
+    strikethrough and spoiler; links, code and quotes are reported.
+    """
+    errors = []
+    opened = [] # markers of the entities open at the current position
+    visible = 0 # UTF-16 code units of the text without the markup
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "\\":
+            if i + 1 >= len(text) or not 0 < ord(text[i + 1]) < 127:
+                errors.append(f"position {i}: backslash does not escape an ASCII character")
+            visible += 1
+            i += 2
+            continue
+        if char in MARKDOWN_V2_SPECIAL:
+            marker = next((m for m in MARKDOWN_V2_ENTITIES if text.startswith(m, i)), None)
+            if marker is None:
+                errors.append(f"position {i}: {char!r} must be escaped")
+                i += 1
+            elif marker in opened:
+                if opened[-1] != marker:
+                    errors.append(f"position {i}: {marker!r} closes over {opened[-1]!r}")
+                opened.remove(marker)
+                i += len(marker)
+            else:
+                opened.append(marker)
+                i += len(marker)
+            continue
+        visible += 2 if ord(char) > 0xFFFF else 1
+        i += 1
+    errors += [f"{marker!r} is never closed" for marker in opened]
+    if visible > MAX_MESSAGE_LENGTH:
+        errors.append(f"{visible} characters, the limit is {MAX_MESSAGE_LENGTH}")
+    return errors
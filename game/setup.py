@@ -0,0 +1,18 @@
+from telegram import Message
+from telegram.ext.filters import MessageFilter
+
+
+class SetupAnswerFilter(MessageFilter):
+    """ Passes messages of chats whose game waits for a setup answer.
+
+    One dict lookup per message, so ordinary chatter in groups is dropped
+    before the setup handler is called.
+    """
+
+    def __init__(self, games: dict) -> None:
+        super().__init__(name="SetupAnswerFilter")
+        self.games = games # chat_id -> GameState
+
+    def filter(self, message: Message) -> bool:
+        game_state = self.games.get(message.chat_id)
+        return game_state is not None and game_state.setup_step is not None
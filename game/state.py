@@ -1,19 +1,264 @@
-DEFAULT_GAME_STATE = {
-    'in_game': False,
-    'language': None,
-    'teams': [],
-    'current_team_index': 0,
-    'round_time': 60, # seconds
-    'words_to_win': 15,
-    'current_round_words': [],
-    'explained_words_count': 0,
-    'skipped_words_count': 0,
-    'current_word_index': 0,
-    'round_timer_message_id': None,
-    'timer_start_time': None,
-    'difficulty': None,
-    'total_scores': {} # Final score for each team
-}
-
-# Global variable for game state 
-GAME_STATES = {}
\ No newline at end of file
+import sys
+import random
+from dataclasses import dataclass, field
+from data.loaders import get_pack, get_pack_id
+from data.packfile import escape
+from game.deck import AliasTable, GameDeck, RoundDeck
+from game.render import summary_line
+from utils.logger import LOGGER
+
+
+@dataclass(slots=True)
+class Team:
+    name: str
+    score: int = 0
+
+
+@dataclass(slots=True)
+class RoundState:
+    """ State of the current (or the last finished) round """
+    countdown: bool = False # True during the "get ready" delay
+    active: bool = False # True while the round timer is running
+    deck: RoundDeck = None
+    explained_words: list = field(default_factory=list) # [(word, translation), ...]
+    skipped_words: list = field(default_factory=list)
+    # summary lines rendered as the words are played, not persisted
+    explained_lines: list = field(default_factory=list)
+    skipped_lines: list = field(default_factory=list)
+    timer_message_id: int = None
+    start_time: float = None
+
+    @property
+    def explained_count(self) -> int:
+        return len(self.explained_words)
+
+    @property
+    def skipped_count(self) -> int:
+        return len(self.skipped_words)
+
+    def to_dict(self) -> dict:
+        return {
+            'countdown': self.countdown,
+            'active': self.active,
+            'deck': self.deck.to_dict() if self.deck is not None else None,
+            'explained_words': self.explained_words,
+            'skipped_words': self.skipped_words,
+            'timer_message_id': self.timer_message_id,
+            'start_time': self.start_time
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, word_deck: GameDeck) -> "RoundState":
+        deck = None
+        if data['deck'] is not None and word_deck is not None:
+            deck = RoundDeck.from_dict(word_deck, data['deck'])
+        explained_words = [tuple(word) for word in data['explained_words']]
+        skipped_words = [tuple(word) for word in data['skipped_words']]
+        return cls(
+            countdown=data['countdown'],
+            active=data['active'],
+            deck=deck,
+            explained_words=explained_words,
+            skipped_words=skipped_words,
+            explained_lines=[summary_line(True, escape(w), escape(t)) for w, t in explained_words],
+            skipped_lines=[summary_line(False, escape(w), escape(t)) for w, t in skipped_words],
+            timer_message_id=data['timer_message_id'],
+            start_time=data['start_time']
+        )
+
+
+def new_game_id() -> int:
+    return random.getrandbits(32)
+
+
+@dataclass(slots=True)
+class GameState:
+    game_id: int = field(default_factory=new_game_id) # tells buttons of earlier games apart
+    round_number: int = 0 # rounds dealt in this game
+    in_game: bool = False
+    language: str = None
+    difficulty: str = None
+    pack_id: str = None # id of the shared word pack, see data/loaders.py
+    teams: list = field(default_factory=list) # [Team, ...]
+    current_team_index: int = 0
+    round_time: int = 60 # seconds
+    words_to_win: int = 15
+    word_deck: GameDeck = None # shuffled once per game, dealt across rounds
+    round: RoundState = field(default_factory=RoundState)
+    setup_step: str = None # the setup answer the chat owes, None outside of the setup
+    naming_index: int = 0 # next team to name during 'set_team_names'
+
+    # setup: set_pack -> set_teams -> name_next_team per team -> set_round_time -> start_game
+
+    def set_pack(self, difficulty: str) -> None:
+        self.difficulty = difficulty
+        self.pack_id = get_pack_id(self.language, difficulty)
+        self.setup_step = 'set_num_teams'
+
+    def set_teams(self, num_teams: int) -> None:
+        self.teams = [Team(f'Team {i+1}') for i in range(num_teams)]
+        self.naming_index = 0
+        self.setup_step = 'set_team_names'
+
+    def name_next_team(self, name: str) -> bool:
+        """ Name the next team, False once every team has a name """
+        self.teams[self.naming_index].name = name
+        self.naming_index += 1
+        if self.naming_index < len(self.teams):
+            return True
+        self.setup_step = 'set_round_time'
+        return False
+
+    def set_round_time(self, round_time: int) -> None:
+        self.round_time = round_time
+        self.setup_step = 'set_words_to_win'
+
+    def start_game(self, words_to_win: int) -> None:
+        self.words_to_win = words_to_win
+        self.setup_step = None
+        self.in_game = True
+
+    # rounds
+
+    @property
+    def current_team(self) -> Team:
+        return self.teams[self.current_team_index]
+
+    @property
+    def round_in_progress(self) -> bool:
+        return self.round.countdown or self.round.active
+
+    def prepare_round(self, pack, sampler: AliasTable = None) -> None:
+        """ Deal the words, by the sampler's weights if there is one, and enter the "get ready" countdown """
+        if self.word_deck is None or self.word_deck.pack is not pack:
+            self.word_deck = GameDeck(pack) # first round, or the pack was reloaded
+        self.round = RoundState(countdown=True, deck=RoundDeck(self.word_deck, sampler=sampler))
+        self.round_number += 1
+
+    def start_round(self, start_time: float) -> None:
+        self.round.countdown = False
+        self.round.active = True
+        self.round.start_time = start_time
+
+    def record_word(self, explained: bool) -> tuple:
+        """ Book the word under the cursor and move to the next one """
+        deck = self.round.deck
+        index = deck.current_index()
+        current_word = deck.pack[index]
+        line = summary_line(explained, *deck.pack.display(index))
+        if explained:
+            self.round.explained_words.append(current_word)
+            self.round.explained_lines.append(line)
+        else:
+            self.round.skipped_words.append(current_word)
+            self.round.skipped_lines.append(line)
+            deck.skip()
+        deck.advance()
+        return current_word
+
+    def finish_round(self) -> int:
+        """ Close the round and give the points to the current team """
+        self.round.active = False
+        self.round.deck.finish()
+        score_this_round = self.round.explained_count
+        self.current_team.score += score_this_round
+        return score_this_round
+
+    # button versions: a press is valid only if its callback_data carries the current one
+
+    def word_token(self) -> str:
+        """ Version of the word card on screen, None if no card should be """
+        if not self.in_game or not self.round.active:
+            return None
+        return f"{self.game_id:x}.{self.round_number:x}.{self.round.deck.cursor:x}"
+
+    def next_round_token(self) -> str:
+        """ Version of the "start the next round" button, None if there is none """
+        if not self.in_game or self.round_in_progress:
+            return None
+        return f"{self.game_id:x}.{self.round_number:x}"
+
+    def winner(self) -> Team:
+        for team in self.teams:
+            if team.score >= self.words_to_win:
+                return team
+        return None
+
+    def next_team(self) -> Team:
+        self.current_team_index = (self.current_team_index + 1) % len(self.teams)
+        return self.current_team
+
+    def memory_size(self) -> int:
+        """ Approximate bytes held by this game only, the shared pack is not counted """
+        size = sys.getsizeof(self) + sys.getsizeof(self.teams) + sys.getsizeof(self.round)
+        size += sum(sys.getsizeof(team) + sys.getsizeof(team.name) for team in self.teams)
+        if self.word_deck is not None:
+            size += sys.getsizeof(self.word_deck) + sys.getsizeof(self.word_deck.order)
+            if self.word_deck.positions is not None:
+                size += sys.getsizeof(self.word_deck.positions)
+        if self.round.deck is not None:
+            deck = self.round.deck
+            size += sys.getsizeof(deck) + sys.getsizeof(deck.indices) + sys.getsizeof(deck.skipped)
+        for words in (self.round.explained_words, self.round.skipped_words):
+            size += sys.getsizeof(words) + sum(sys.getsizeof(word) for word in words)
+        for lines in (self.round.explained_lines, self.round.skipped_lines):
+            size += sys.getsizeof(lines) + sum(sys.getsizeof(line) for line in lines)
+        return size
+
+    # persistence
+
+    def to_dict(self) -> dict:
+        """ JSON friendly snapshot of the game """
+        return {
+            'game_id': self.game_id,
+            'round_number': self.round_number,
+            'in_game': self.in_game,
+            'language': self.language,
+            'difficulty': self.difficulty,
+            'pack_id': self.pack_id,
+            'teams': [[team.name, team.score] for team in self.teams],
+            'current_team_index': self.current_team_index,
+            'round_time': self.round_time,
+            'words_to_win': self.words_to_win,
+            # the order is stored apart, see deck_snapshot()
+            'word_deck': {'pack_id': self.word_deck.pack.pack_id} if self.word_deck is not None else None,
+            'round': self.round.to_dict(),
+            'setup_step': self.setup_step,
+            'naming_index': self.naming_index
+        }
+
+    def deck_snapshot(self) -> dict:
+        """ The word deck if it changed since the last call, None otherwise.
+        It only changes when a round is dealt or finished """
+        deck = self.word_deck
+        if deck is None or deck.saved:
+            return None
+        deck.saved = True
+        return deck.to_dict()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GameState":
+        word_deck = None
+        if data['word_deck'] is not None:
+            pack = get_pack(data['word_deck']['pack_id'], LOGGER)
+            word_deck = GameDeck.from_dict(pack, data['word_deck'])
+        return cls(
+            game_id=data.get('game_id') or new_game_id(),
+            round_number=data.get('round_number', 0),
+            in_game=data['in_game'],
+            language=data['language'],
+            difficulty=data['difficulty'],
+            pack_id=data['pack_id'],
+            teams=[Team(name, score) for name, score in data['teams']],
+            current_team_index=data['current_team_index'],
+            round_time=data['round_time'],
+            words_to_win=data['words_to_win'],
+            word_deck=word_deck,
+            round=RoundState.from_dict(data['round'], word_deck),
+            setup_step=data.get('setup_step'),
+            naming_index=data.get('naming_index', 0)
+        )
+
+
+# Global variable for game state: chat_id -> GameState
+GAME_STATES = {}
@@ -0,0 +1,138 @@
+import asyncio
+import sqlite3
+from array import array
+from data.loaders import WORD_PACKS
+from game.deck import AliasTable
+from utils.logger import LOGGER
+
+
+# Weight of a word from its (explained, skipped) counts. The +1 / +2 keep
+# words nobody played yet in the deal, at an even chance
+WEIGHTINGS = {
+    'skipped': lambda explained, skipped: (skipped + 1) / (explained + skipped + 2),
+    'explained': lambda explained, skipped: (explained + 1) / (explained + skipped + 2),
+}
+
+
+def zeros(size: int) -> array:
+    return array('I', [0]) * size
+
+
+class PackStats:
+    """ Counts of one loaded pack since the last flush, indexed like the pack """
+    __slots__ = ("pack", "explained", "skipped", "pending", "sampler", "stale")
+
+    def __init__(self, pack) -> None:
+        self.pack = pack
+        self.explained = zeros(len(pack))
+        self.skipped = zeros(len(pack))
+        self.pending = 0 # presses counted since the last flush
+        self.sampler = None # AliasTable of the pack, built by a flush
+        self.stale = True # the counts changed since the sampler was built
+
+    def take(self) -> tuple:
+        """ The counts gathered so far, counting starts over """
+        counts = self.explained, self.skipped
+        self.explained, self.skipped = zeros(len(self.pack)), zeros(len(self.pack))
+        self.pending = 0
+        return counts
+
+    def give_back(self, explained: array, skipped: array) -> None:
+        """ Counts of a failed flush go into the next one """
+        for index, (explained_count, skipped_count) in enumerate(zip(explained, skipped)):
+            if explained_count or skipped_count:
+                self.explained[index] += explained_count
+                self.skipped[index] += skipped_count
+                self.pending += explained_count + skipped_count
+
+
+class WordStats:
+    """ Explain and skip counts of every played word.
+
+    record() increments one counter of a compact per-pack array, which is
+    all a button press pays. flush() runs on an interval: it adds the counts
+    gathered since the last flush to the store in one batch and, with a
+    weighting, rebuilds the alias tables of the packs whose counts changed.
+    Both happen in a thread, the event loop only swaps arrays and tables.
+    """
+
+    def __init__(self, store, weighting: str = None) -> None:
+        if weighting is not None and weighting not in WEIGHTINGS:
+            raise ValueError(f"Unknown word weighting: {weighting}")
+        self.store = store
+        self.weight = WEIGHTINGS.get(weighting)
+        self.packs = {} # pack -> PackStats, a reloaded pack is a new object and starts over
+        self.counters = {'recorded': 0, 'flushed': 0, 'rebuilt': 0}
+
+    def _stats(self, pack) -> PackStats:
+        stats = self.packs.get(pack)
+        if stats is None:
+            stats = self.packs[pack] = PackStats(pack)
+        return stats
+
+    def record(self, pack, index: int, explained: bool) -> None:
+        stats = self._stats(pack)
+        if explained:
+            stats.explained[index] += 1
+        else:
+            stats.skipped[index] += 1
+        stats.pending += 1
+        stats.stale = True
+        self.counters['recorded'] += 1
+
+    def sampler(self, pack) -> AliasTable:
+        """ Sampler for dealing from the pack, None deals uniformly: no weighting
+        is configured, or the first flush since the pack was loaded is still due """
+        if self.weight is None:
+            return None
+        return self._stats(pack).sampler
+
+    async def flush(self) -> int:
+        """ Store the gathered counts, returns the number of written rows """
+        rebuild = self.weight is not None
+        batches = [
+            (stats, *stats.take()) for stats in list(self.packs.values())
+            if stats.pending or (rebuild and stats.stale)
+        ]
+        if not batches:
+            return 0
+        for stats, _, _ in batches:
+            stats.stale = False # a press during the flush marks it again
+        try:
+            written, samplers = await asyncio.to_thread(self._write, batches, rebuild)
+        except sqlite3.Error as e:
+            LOGGER.error(f"Failed to write word statistics: {e}")
+            for stats, explained, skipped in batches:
+                stats.give_back(explained, skipped)
+                stats.stale = True
+            return 0
+
+        for (stats, _, _), sampler in zip(batches, samplers):
+            if sampler is not None:
+                stats.sampler = sampler
+                self.counters['rebuilt'] += 1
+        # packs replaced by a reload are forgotten once everything of them is written
+        for pack, stats in list(self.packs.items()):
+            if WORD_PACKS.get(pack.pack_id) is not pack and not stats.pending:
+                del self.packs[pack]
+        self.counters['flushed'] += written
+        return written
+
+    def _write(self, batches: list, rebuild: bool) -> tuple:
+        """ Runs in a thread: add the counts to the store, then build the samplers """
+        rows = []
+        for stats, explained, skipped in batches:
+            pack = stats.pack
+            rows.extend(
+                (pack.pack_id, pack[index][0], explained[index], skipped[index])
+                for index in range(len(pack)) if explained[index] or skipped[index]
+            )
+        if rows:
+            self.store.add(rows)
+        samplers = [self._build(stats.pack) if rebuild else None for stats, _, _ in batches]
+        return len(rows), samplers
+
+    def _build(self, pack) -> AliasTable:
+        """ Alias table from the stored counts, which include the other processes' """
+        counts = self.store.load(pack.pack_id)
+        return AliasTable([self.weight(*counts.get(pack[index][0], (0, 0))) for index in range(len(pack))])
@@ -0,0 +1,292 @@
+import json
+import time
+import sqlite3
+import threading
+from utils.logger import LOGGER
+
+
+class StateStore:
+    """ Persistent storage for game states.
+
+    Handlers only mark a chat as dirty, which is a set insertion. A periodic
+    job calls persist(), which snapshots the dirty games once (several
+    updates of one chat are coalesced) and hands them over to the backend.
+    The word deck of a game is stored apart: it is large and only changes
+    when a round is dealt or finished, not on every press.
+    """
+
+    def __init__(self) -> None:
+        self.dirty = set()
+
+    def mark_dirty(self, chat_id: int) -> None:
+        self.dirty.add(chat_id)
+
+    def persist(self, game_states: dict, dump, dump_deck=None) -> int:
+        """ Snapshot dirty games with dump(state) -> dict and write them out.
+        dump_deck(state) -> dict gives the deck, None if it is stored already """
+        if not self.dirty:
+            return 0
+        dirty, self.dirty = self.dirty, set()
+        snapshots, decks = {}, {}
+        for chat_id in dirty:
+            game_state = game_states.get(chat_id)
+            if game_state is None:
+                snapshots[chat_id] = decks[chat_id] = None
+                continue
+            snapshots[chat_id] = json.dumps(dump(game_state), ensure_ascii=False)
+            deck = dump_deck(game_state) if dump_deck is not None else None
+            if deck is not None:
+                decks[chat_id] = json.dumps(deck)
+        self.write(snapshots, decks)
+        return len(snapshots)
+
+    def write(self, snapshots: dict, decks: dict) -> None:
+        """ Store {chat_id: json or None} of games and of decks, None removes it """
+        raise NotImplementedError
+
+    def load_all(self) -> dict:
+        """ {chat_id: dict} of every stored game, with its deck as 'word_deck' """
+        raise NotImplementedError
+
+    @staticmethod
+    def join_deck(state: dict, deck: str) -> dict:
+        """ Put the stored deck into the game, older snapshots carry it inline """
+        if state.get('word_deck') is not None and 'order' not in state['word_deck']:
+            state['word_deck'] = json.loads(deck) if deck is not None else None
+        return state
+
+    def flush(self) -> int:
+        """ Make written snapshots visible to other processes now """
+        return 0
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """ Keeps snapshots in the process, useful for tests and local runs """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.snapshots = {}
+        self.decks = {}
+
+    def write(self, snapshots: dict, decks: dict) -> None:
+        for stored, written in ((self.snapshots, snapshots), (self.decks, decks)):
+            for chat_id, snapshot in written.items():
+                if snapshot is None:
+                    stored.pop(chat_id, None)
+                else:
+                    stored[chat_id] = snapshot
+
+    def load_all(self) -> dict:
+        return {
+            chat_id: self.join_deck(json.loads(snapshot), self.decks.get(chat_id))
+            for chat_id, snapshot in self.snapshots.items()
+        }
+
+
+class SQLiteStateStore(StateStore):
+    """ SQLite store in WAL mode with a background writer thread.
+
+    write() only swaps snapshots into a pending dict, the writer thread
+    commits them in one transaction every `flush_interval` seconds. A crash
+    loses at most the updates of the last flush interval.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0) -> None:
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._pending_decks = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock() # held from taking the pending snapshots until they are committed
+        self._wake = threading.Event()
+        self._closed = False
+
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS game_states ("
+                "chat_id INTEGER PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS game_decks (chat_id INTEGER PRIMARY KEY, deck TEXT NOT NULL)"
+            )
+        connection.close()
+
+        self._thread = threading.Thread(target=self._run, name="state-store-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL") # durable against process crashes
+        return connection
+
+    def write(self, snapshots: dict, decks: dict) -> None:
+        with self._lock:
+            self._pending.update(snapshots)
+            self._pending_decks.update(decks)
+
+    def load_all(self) -> dict:
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT s.chat_id, s.state, d.deck FROM game_states s LEFT JOIN game_decks d ON d.chat_id = s.chat_id"
+            ).fetchall()
+        finally:
+            connection.close()
+        return {chat_id: self.join_deck(json.loads(state), deck) for chat_id, state, deck in rows}
+
+    def flush(self, connection: sqlite3.Connection = None) -> int:
+        """ Commit pending snapshots now, returns the number of written games.
+        A commit of the writer thread in progress is waited for first, so
+        everything written before the call is committed when it returns """
+        with self._write_lock:
+            return self._commit(connection)
+
+    def _commit(self, connection: sqlite3.Connection) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            pending_decks, self._pending_decks = self._pending_decks, {}
+        if not pending and not pending_decks:
+            return 0
+
+        own_connection = connection is None
+        if own_connection:
+            connection = self._connect()
+        now = time.time()
+        upserts = [(chat_id, state, now) for chat_id, state in pending.items() if state is not None]
+        deletes = [(chat_id,) for chat_id, state in pending.items() if state is None]
+        deck_upserts = [(chat_id, deck) for chat_id, deck in pending_decks.items() if deck is not None]
+        deck_deletes = [(chat_id,) for chat_id, deck in pending_decks.items() if deck is None]
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO game_states (chat_id, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(chat_id) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at",
+                    upserts
+                )
+                connection.executemany("DELETE FROM game_states WHERE chat_id = ?", deletes)
+                connection.executemany(
+                    "INSERT INTO game_decks (chat_id, deck) VALUES (?, ?) "
+                    "ON CONFLICT(chat_id) DO UPDATE SET deck=excluded.deck",
+                    deck_upserts
+                )
+                connection.executemany("DELETE FROM game_decks WHERE chat_id = ?", deck_deletes)
+        except sqlite3.Error as e:
+            LOGGER.error(f"Failed to write game states: {e}")
+            with self._lock: # keep newer snapshots, retry the rest on the next flush
+                self._pending = {**pending, **self._pending}
+                self._pending_decks = {**pending_decks, **self._pending_decks}
+            return 0
+        finally:
+            if own_connection:
+                connection.close()
+        return len(pending)
+
+    def _run(self) -> None:
+        connection = self._connect()
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush(connection)
+        self.flush(connection)
+        connection.close()
+
+    def close(self) -> None:
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+
+
+class WordStatsStore:
+    """ Explain and skip counts per (pack_id, word), summed over all games and processes """
+
+    def add(self, rows: list) -> None:
+        """ Add [(pack_id, word, explained, skipped), ...] to the stored counts """
+        raise NotImplementedError
+
+    def load(self, pack_id: str) -> dict:
+        """ {word: (explained, skipped)} of the pack """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryWordStatsStore(WordStatsStore):
+    def __init__(self) -> None:
+        self.counts = {} # pack_id -> {word: (explained, skipped)}
+
+    def add(self, rows: list) -> None:
+        for pack_id, word, explained, skipped in rows:
+            counts = self.counts.setdefault(pack_id, {})
+            old_explained, old_skipped = counts.get(word, (0, 0))
+            counts[word] = (old_explained + explained, old_skipped + skipped)
+
+    def load(self, pack_id: str) -> dict:
+        return dict(self.counts.get(pack_id, {}))
+
+
+class SQLiteWordStatsStore(WordStatsStore):
+    """ Counts in a table next to the game states. Rows are added up in SQL,
+    so several worker processes can flush into the same database """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS word_stats ("
+                "pack_id TEXT NOT NULL, word TEXT NOT NULL, explained INTEGER NOT NULL, skipped INTEGER NOT NULL, "
+                "PRIMARY KEY (pack_id, word))"
+            )
+        connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def add(self, rows: list) -> None:
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO word_stats (pack_id, word, explained, skipped) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(pack_id, word) DO UPDATE SET "
+                    "explained=explained + excluded.explained, skipped=skipped + excluded.skipped",
+                    rows
+                )
+        finally:
+            connection.close()
+
+    def load(self, pack_id: str) -> dict:
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT word, explained, skipped FROM word_stats WHERE pack_id = ?", (pack_id,)
+            ).fetchall()
+        finally:
+            connection.close()
+        return {word: (explained, skipped) for word, explained, skipped in rows}
+
+
+def create_store(kind: str, path: str) -> StateStore:
+    if kind == "memory":
+        return MemoryStateStore()
+    if kind == "sqlite":
+        return SQLiteStateStore(path)
+    raise ValueError(f"Unknown state store: {kind}")
+
+def create_stats_store(kind: str, path: str) -> WordStatsStore:
+    """ Word statistics live in the same kind of store as the games """
+    if kind == "memory":
+        return MemoryWordStatsStore()
+    if kind == "sqlite":
+        return SQLiteWordStatsStore(path)
+    raise ValueError(f"Unknown state store: {kind}")
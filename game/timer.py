@@ -0,0 +1,138 @@
+import time
+import asyncio
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+from utils.ratelimit import TokenBucket
+from utils.metrics import observe_timer_lag, timed
+from utils.outbox import COSMETIC, OUTBOX
+from utils.logger import LOGGER
+
+
+TICK_INTERVAL = 1 # seconds, one tick serves all active rounds
+COARSE_STEP = 5 # countdown is shown in 5 second steps ...
+FINE_THRESHOLD = 10 # ... and every second in the last 10 seconds
+EDITS_PER_SECOND = 20 # global budget for cosmetic countdown edits
+EDITS_BURST = 20
+
+
+def timer_text(remaining_time: int) -> str:
+    return f"⏰⏰⏰ *{remaining_time}* seconds left ⏰⏰⏰"
+
+def displayed_time(remaining_time: int) -> int:
+    """ Value shown on the countdown message, coarse until the last seconds """
+    if remaining_time <= FINE_THRESHOLD:
+        return remaining_time
+    return -(-remaining_time // COARSE_STEP) * COARSE_STEP
+
+
+class RoundTimer:
+    __slots__ = ("chat_id", "message_id", "start_time", "round_time", "last_text")
+
+    def __init__(self, chat_id: int, message_id: int, start_time: float, round_time: int) -> None:
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.start_time = start_time
+        self.round_time = round_time
+        self.last_text = timer_text(round_time)
+
+    def remaining(self, now: float) -> int:
+        return int(self.round_time - (now - self.start_time))
+
+
+class TimerScheduler:
+    """ Single repeating job that drives the countdown of every active round.
+
+    Round expiry and the cosmetic countdown are separate: an expired round is
+    always ended, while countdown edits are skipped when the text would not
+    change, and dropped when the global edit budget is used up. Edits go out
+    through the outbox behind the word cards, a queued edit of a round is
+    replaced by its next one, so the tick never waits for them.
+    """
+
+    def __init__(self, rate: float = EDITS_PER_SECOND, burst: float = EDITS_BURST) -> None:
+        self.rounds = {}
+        self.bucket = TokenBucket(rate, burst)
+        self.on_expire = None
+        self.expiring = set() # running on_expire tasks
+        self.counters = {'sent': 0, 'suppressed': 0, 'throttled': 0, 'failed': 0, 'expired': 0}
+
+    def start(self, job_queue, on_expire) -> None:
+        """ on_expire(chat_id, context) is awaited when a round runs out of time """
+        self.on_expire = on_expire
+        job_queue.run_repeating(
+            timed(self.tick, "round_timers"), interval=TICK_INTERVAL, first=TICK_INTERVAL, name="round_timers"
+        )
+
+    def add(self, chat_id: int, message_id: int, start_time: float, round_time: int) -> None:
+        self.rounds[chat_id] = RoundTimer(chat_id, message_id, start_time, round_time)
+
+    def remove(self, chat_id: int) -> None:
+        self.rounds.pop(chat_id, None)
+        OUTBOX.drop(("timer", chat_id))
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self.rounds
+
+    async def tick(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        now = time.time()
+        if context.job is not None and context.job.next_t is not None:
+            # next_t already points to the following run
+            observe_timer_lag(now - context.job.next_t.timestamp() + TICK_INTERVAL)
+        expired = []
+        for round_timer in list(self.rounds.values()):
+            remaining_time = round_timer.remaining(now)
+            if remaining_time <= 0:
+                expired.append(round_timer.chat_id)
+                continue
+
+            text = timer_text(displayed_time(remaining_time))
+            if text == round_timer.last_text:
+                self.counters['suppressed'] += 1
+            elif not self.bucket.consume():
+                self.counters['throttled'] += 1 # retried on the next tick
+            else:
+                round_timer.last_text = text
+                self._edit(context, round_timer, text)
+
+        for chat_id in expired:
+            self.remove(chat_id)
+            # a round end waits for the chat's running updates, the next tick must not
+            task = asyncio.create_task(self._expire(context, chat_id))
+            self.expiring.add(task)
+            task.add_done_callback(self.expiring.discard)
+        self.counters['expired'] += len(expired)
+
+    async def _expire(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
+        try:
+            await self.on_expire(chat_id, context)
+        except Exception as e:
+            LOGGER.error(f"Error while finishing the round: {e}")
+
+    def _edit(self, context: ContextTypes.DEFAULT_TYPE, round_timer: RoundTimer, text: str) -> None:
+        edit = OUTBOX.submit(
+            COSMETIC,
+            context.bot.edit_message_text,
+            key=("timer", round_timer.chat_id),
+            chat_id=round_timer.chat_id,
+            message_id=round_timer.message_id,
+            text=text,
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+        edit.add_done_callback(self._edited)
+
+    def _edited(self, edit: asyncio.Future) -> None:
+        if edit.cancelled():
+            return
+        if edit.exception() is not None:
+            # the countdown is cosmetic, the round goes on and ends on expiry
+            self.counters['failed'] += 1
+            LOGGER.warning(f"Error while updating the timer message: {edit.exception()}")
+        elif edit.result() is not None:
+            self.counters['sent'] += 1
+
+    def stats(self) -> dict:
+        return {'active_rounds': len(self.rounds), **self.counters}
+
+
+# Global scheduler for all round timers
+TIMERS = TimerScheduler()
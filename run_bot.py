@@ -1,244 +1,303 @@
 import time
-import random 
 import asyncio
 from telegram.constants import ParseMode
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
     CallbackQueryHandler, 
+    TypeHandler,
     ContextTypes, 
     filters
 )
+from telegram.request import BaseRequest
 from game.help import help_command
-from game.state import (
-    DEFAULT_GAME_STATE,
-    GAME_STATES
-)
+from game.state import GameState, GAME_STATES
+from game.store import MemoryStateStore, MemoryWordStatsStore, create_stats_store, create_store
+from game.stats import WordStats
+from game.eviction import ExpiredGameHandler, GameEvictor
 from game.settings import set_default_commands
-from data.loaders import load_words
+from game.setup import SetupAnswerFilter
+from game.timer import TIMERS, timer_text
+from game import render
+from data.loaders import (
+    get_pack,
+    preload_packs,
+    reload_changed_packs
+)
 from utils.logger import LOGGER
+from utils.options import (
+    STATE_STORE,
+    STATE_DB_PATH,
+    STATE_PERSIST_INTERVAL,
+    UPDATE_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONCURRENCY,
+    WEBHOOK_RECORD_PATH,
+    SHARD_WORKERS,
+    CONCURRENT_UPDATES,
+    OUTBOX_RATE,
+    OUTBOX_CHAT_RATE,
+    OUTBOX_CHAT_BURST,
+    WORD_STATS_FLUSH_INTERVAL,
+    WORD_WEIGHTING,
+    GAME_IDLE_TTL,
+    MAX_GAMES,
+    EVICTION_INTERVAL,
+    LIVE_WORD_CARD,
+    METRICS_LOG_INTERVAL,
+    METRICS_LISTEN,
+    METRICS_PORT,
+    PROFILE_INTERVAL,
+    PROFILE_DUMP_INTERVAL,
+    PROFILE_OUTPUT
+)
+from utils.concurrency import CHAT_LOCKS, ChatUpdateProcessor
+from utils.metrics import (
+    CountingRequest, MetricsServer, count_rejected_press, count_update, register_gauge, summary, timed
+)
+from utils.outbox import CARD, COSMETIC, OUTBOX, SUMMARY
+from utils.profiler import SamplingProfiler
+from utils.webhook import WebhookServer, application_dispatcher, serve_webhook
+from utils.sharding import ShardRouter, serve_shard, serve_sharded
 from config import BOT_TOKEN
 
+# Persistent copy of GAME_STATES, replaced by the configured store in main()
+STORE = MemoryStateStore()
 
-async def start_next_round_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-    await query.delete_message() # remove previos button
-    await start_round(update, context)
+# Explain and skip counts of the words, replaced like STORE
+WORD_STATS = WordStats(MemoryWordStatsStore(), WORD_WEIGHTING)
 
-async def show_final_scores(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int = None) -> None:
-    if update and update.effective_chat:
-        chat_id = update.effective_chat.id
-    elif chat_id is None:
-        raise ValueError("No chat_id provided to show_final_scores")
+# Tracks chat activity, idle and surplus games are dropped by the evict_games job
+EVICTOR = GameEvictor(GAME_IDLE_TTL, MAX_GAMES)
 
-    game_state = GAME_STATES[chat_id]
+# Lets through only the messages of chats whose setup waits for an answer
+SETUP_ANSWER = SetupAnswerFilter(GAME_STATES)
 
-    scores_text = "🏁 *Final Scoreboard* 🏁\n\n"
+# The bot only reacts to messages and button presses
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
-    for team_name, score in game_state['total_scores'].items():
-        scores_text += f"👥 *{team_name}*: *{score}* points 🏅\n"
+ROUND_COUNTDOWN = 3 # seconds between "Get ready!" and the first word
 
-    scores_text += "\n🥇 Congratulations to the winning team\! 🎉"
 
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text=scores_text,
-        parse_mode=ParseMode.MARKDOWN_V2
+async def reply_text(update: Update, text: str, **kwargs):
+    """ Message in the chat of the update, sent through the outbox """
+    return await OUTBOX.submit(
+        SUMMARY, update.get_bot().send_message, chat_id=update.effective_chat.id, text=text, **kwargs
     )
 
-    # clean the state 
-    GAME_STATES[chat_id] = DEFAULT_GAME_STATE.copy()
+async def edit_text(query, text: str, **kwargs):
+    """ Edit the message of the pressed button through the outbox """
+    return await OUTBOX.submit(
+        SUMMARY, query.get_bot().edit_message_text,
+        chat_id=query.message.chat_id, message_id=query.message.message_id, text=text, **kwargs
+    )
+
+async def reject_stale_press(query, token: str) -> bool:
+    """ Answer a press that doesn't carry the current button version, True if it was stale """
+    button, _, pressed = query.data.partition(':')
+    if pressed == token:
+        return False
+    count_rejected_press(button)
+    await query.answer()
+    return True
+
+async def start_next_round_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if await reject_stale_press(query, GAME_STATES[query.message.chat_id].next_round_token()):
+        return # double tap, the round is already starting
+    await query.answer()
+    OUTBOX.post(COSMETIC, context.bot.delete_message, chat_id=query.message.chat_id, message_id=query.message.message_id)
+    await start_round(update, context)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         chat_id = update.effective_chat.id
-        GAME_STATES[chat_id] = DEFAULT_GAME_STATE.copy()
-        await update.message.reply_text(
+        drop_game(context.job_queue, chat_id)
+        await reply_text(
+            update,
             "⛔ Game canceled.\n" 
             "You can start a new game with /start."
     )
 
-async def end_round(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int = None) -> None:
+async def end_round(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int = None, timed_out: bool = False) -> None:
     """ Finish round and move to the next one """
     if chat_id is None: # If call not from the force function 
         chat_id = update.effective_chat.id
 
     game_state = GAME_STATES[chat_id]
 
-    if not game_state['in_game']:
+    # idempotent: the timer and a late word press may both end the round
+    if not game_state.in_game or not game_state.round.active:
         return 
 
-    current_team = game_state['teams'][game_state['current_team_index']]
-    score_this_round = game_state['explained_words_count']
+    TIMERS.remove(chat_id)
+    STORE.mark_dirty(chat_id)
 
-    current_team['score'] += score_this_round
-    game_state['total_scores'][current_team['name']] += score_this_round
+    current_team = game_state.current_team
+    round_state = game_state.round
+    score_this_round = game_state.finish_round()
 
-    explained_text = "\n".join(
-        [f"✅ *{w}* \\(_{t}_\\)" for w, t in game_state["explained_words"]]
-    ) or "—"
-    
-    skipped_text = "\n".join(
-        [f"❌ *{w}* \\(_{t}_\\)" for w, t in game_state['skipped_words']]
-    ) or "—"
-
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text=(
-            f"⏹️ *Round for team* *{current_team['name']}* *is over\\!* \n"
-            f"👍 *Words explained:* {game_state['explained_words_count']} \n"
-            f"❌ *Words skipped:* {game_state['skipped_words_count']} \n"
-            f"🏅 *Points this round:* {score_this_round} \n"
-            f"📊 *Total score for team* *{current_team['name']}*: {current_team['score']} \n\n"
-            f"*Explained words:* \n{explained_text}\n\n"
-            f"*Skipped words:* \n{skipped_text}"
-        ),
-        parse_mode=ParseMode.MARKDOWN_V2
-    )
+    # the whole end of the round goes out as one message
+    parts = ["⌛️ Time's up\\!"] if timed_out else []
+    parts.append(render.round_summary_text(current_team, round_state, score_this_round))
 
     # win? 
-    for team in game_state['teams']:
-        if team['score'] >= game_state['words_to_win']:
-            game_state['in_game'] = False # game is finished 
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text = (
-                    f"🏆 *WIN\\!\\!* 🎉\n\n"
-                    f"Team *{team['name']}* reached *{team['score']}* points and won the game\\! 🥳"
-                ),
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
-            await show_final_scores(update, context, chat_id)
-            return
-
-    # To the next team 
-    game_state['current_team_index'] = (game_state['current_team_index'] + 1) % len(game_state['teams'])
-
-    # next round? 
-    keyboard = [[InlineKeyboardButton("Start the next round", callback_data='start_next_round')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text=f"🏃The next turn for team: **{game_state['teams'][game_state['current_team_index']]['name']}**",
-        reply_markup=reply_markup,
-        parse_mode=ParseMode.MARKDOWN_V2
-    )
+    reply_markup = None
+    team = game_state.winner()
+    if team is not None:
+        game_state.in_game = False # game is finished 
+        parts.append(render.win_text(team))
+        parts.append(render.final_scores_text(game_state.teams))
+
+        # clean the state 
+        drop_game(context.job_queue, chat_id)
+    else:
+        # To the next team 
+        next_team = game_state.next_team()
+
+        # next round? 
+        reply_markup = render.next_round_keyboard(game_state.next_round_token())
+        parts.append(render.next_turn_text(next_team))
+
+    text = "\n\n".join(parts)
+    if not render.fits(text):
+        # long team names: the summary goes first, the button comes with the rest
+        await OUTBOX.submit(
+            SUMMARY,
+            context.bot.send_message,
+            chat_id=chat_id,
+            text="\n\n".join(parts[:-1]),
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+        text = parts[-1]
+    query = update.callback_query if update else None
+    if LIVE_WORD_CARD and query is not None:
+        # the word card itself turns into the round summary
+        await OUTBOX.submit(
+            SUMMARY,
+            context.bot.edit_message_text,
+            chat_id=chat_id,
+            message_id=query.message.message_id,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+    else:
+        await OUTBOX.submit(
+            SUMMARY,
+            context.bot.send_message,
+            chat_id=chat_id,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
 
 
 async def handle_word_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """ Process the word: skip or accept """
     query = update.callback_query
-    await query.answer()
     chat_id = query.message.chat_id
     game_state = GAME_STATES[chat_id]
 
-    if not game_state['in_game']:
-        await query.edit_message_text("❌ Game is not active.")
+    # a card of a finished round or game, or a second tap on the same card
+    if await reject_stale_press(query, game_state.word_token()):
         return
 
-    action = query.data
-
-    current_word = list(game_state["current_round_words"].items())[game_state["current_word_index"]]
+    explained = query.data.startswith('word_explained')
+    deck = game_state.round.deck
+    WORD_STATS.record(deck.pack, deck.current_index(), explained)
+    game_state.record_word(explained)
 
-    if action == 'word_explained':
-        game_state['explained_words_count'] += 1
-        game_state["explained_words"].append(current_word)
-    elif action == 'word_skipped':
-        game_state['skipped_words_count'] += 1
-        game_state["skipped_words"].append(current_word)
+    # do we have time? 
+    elapsed_time = time.time() - game_state.round.start_time
+    time_left = elapsed_time < game_state.round_time
+
+    # the word is counted: the next card has to go out even if the answer fails
+    if LIVE_WORD_CARD:
+        # answer the button and update the card at the same time
+        if time_left:
+            await asyncio.gather(
+                show_next_word(chat_id, context, message_id=query.message.message_id),
+                answer_press(query)
+            )
+        else:
+            await asyncio.gather(end_round(update, context), answer_press(query))
+        return
 
-    game_state['current_word_index'] += 1
+    # remove previous word behind the next one, gather starts them in this order
+    await asyncio.gather(
+        show_next_word(chat_id, context) if time_left else end_round(update, context),
+        delete_message(context, chat_id, query.message.message_id),
+        answer_press(query)
+    )
 
-    # remove previous word 
+async def answer_press(query) -> None:
+    """ Answer a button whose press already changed the game, a failure only stops the spinner """
     try:
-        await query.delete_message()
-    except Exception as e:
-        LOGGER.warning(f"Impossible to delete the message. {e}")
+        await query.answer()
+    except TelegramError as e:
+        LOGGER.warning(f"Failed to answer a button press: {e}")
 
-    # do we have time? 
-    elapsed_time = time.time() - game_state['timer_start_time']
-    if elapsed_time < game_state['round_time']:
-        await show_next_word(update, context)
-    else:
-        await end_round(update, context)
+async def delete_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    """ Queue a delete that nobody waits for """
+    OUTBOX.post(COSMETIC, context.bot.delete_message, chat_id=chat_id, message_id=message_id)
 
 async def end_round_force(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    game_state = GAME_STATES[chat_id]
-    if game_state['in_game']:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="⌛️ Time's up!"
-        )
-        await end_round(None, context, chat_id=chat_id)
-
-async def update_timer(context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = context.job.chat_id
-    message_id = context.job.data
-    game_state = GAME_STATES[chat_id]
+    # waits for a word press of the chat that is being handled right now
+    async with CHAT_LOCKS.hold(chat_id):
+        game_state = GAME_STATES.get(chat_id)
+        if game_state is not None and game_state.in_game:
+            await end_round(None, context, chat_id=chat_id, timed_out=True)
 
-    if not game_state['in_game']:
-        context.job.schedule_removal()
-        return # If game is not active, stop timer 
-
-    elapsed_time = time.time() - game_state['timer_start_time']
-    remaining_time = int(game_state['round_time'] - elapsed_time)
-
-    if remaining_time > 0:
-        try:
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=f"⏰⏰⏰ *{remaining_time}* seconds left ⏰⏰⏰",
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
-        except Exception as e:
-            LOGGER.warning(f"Error while updating the timer message: {e}")
-            context.job.schedule_removal()
-            await end_round_force(chat_id, context)
-    else:
-        context.job.schedule_removal()
-        await end_round_force(chat_id, context)
-
-async def start_timer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def start_timer(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
     """ Run round timer """
-    chat_id = update.effective_chat.id
     game_state = GAME_STATES[chat_id]
 
     # first timer message
-    timer_message = await context.bot.send_message(
+    timer_message = await OUTBOX.submit(
+        SUMMARY,
+        context.bot.send_message,
         chat_id=chat_id,
-        text=f"⏰⏰⏰ *{game_state['round_time']}* seconds left ⏰⏰⏰",
+        text=timer_text(game_state.round_time),
         parse_mode=ParseMode.MARKDOWN_V2
     )
-    game_state['round_timer_message_id'] = timer_message.message_id
+    game_state.round.timer_message_id = timer_message.message_id
 
-    # update timer
-    context.application.job_queue.run_repeating(
-        callback=update_timer,
-        interval=1,
-        first=1,
-        chat_id=chat_id,
-        name=f"timer_{chat_id}",
-        data=timer_message.message_id
-    )
+    # countdown and expiry are driven by the shared scheduler
+    TIMERS.add(chat_id, timer_message.message_id, game_state.round.start_time, game_state.round_time)
 
-async def show_next_word(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_chat.id
+async def show_next_word(chat_id: int, context: ContextTypes.DEFAULT_TYPE, message_id: int = None) -> None:
+    """ Send the word card, or edit the given card in place """
     game_state = GAME_STATES[chat_id]
+    if not game_state.in_game or not game_state.round.active:
+        return # the round ended while the previous card was handled
+
+    deck = game_state.round.deck
+    text = render.word_card(deck.pack, deck.current_index())
+    reply_markup = render.word_keyboard(game_state.word_token())
+    if message_id is not None:
+        await OUTBOX.submit(
+            CARD,
+            context.bot.edit_message_text,
+            text=text,
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+        return
 
-    word = list(game_state['current_round_words'].keys())[game_state['current_word_index']]
-    translate = game_state['current_round_words'][word]
-    keyboard = [
-        [InlineKeyboardButton("✅ Understood", callback_data='word_explained')],
-        [InlineKeyboardButton("❌ Skip", callback_data='word_skipped')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(
+    await OUTBOX.submit(
+        CARD,
+        context.bot.send_message,
         chat_id=chat_id,
-        text = f"📝📝📝 *{word}* 📝📝📝 \n\n"
-               f"🌐 Translation: \\(_{translate}_\\)",
+        text=text,
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN_V2
     )
@@ -248,108 +307,128 @@ async def start_round(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     chat_id = update.effective_chat.id
     game_state = GAME_STATES[chat_id]
 
-    if not game_state['in_game']:
-        await update.message.reply_text("❌ The game hasn't started yet. Use /start to begin.")
+    if not game_state.in_game:
+        await reply_text(update, "❌ The game hasn't started yet. Use /start to begin.")
         return
 
-    current_team = game_state['teams'][game_state['current_team_index']]
-    await context.bot.send_message(
+    if game_state.round_in_progress:
+        return
+
+    # the words are dealt right away, the round itself starts after the countdown
+    pack = get_pack(game_state.pack_id, LOGGER)
+    game_state.prepare_round(pack, WORD_STATS.sampler(pack))
+    STORE.mark_dirty(chat_id)
+    schedule_countdown(context.application.job_queue, chat_id)
+
+    await OUTBOX.submit(
+        SUMMARY,
+        context.bot.send_message,
         chat_id=chat_id,
-        text = ( f"🚨 The round for team *{current_team['name']}* is starting\\! \n"
-                 f"⏳ You have *{game_state['round_time']}* seconds\\. \n\n" 
-                 f"🚀🚀🚀 *Get ready\\! 🚀🚀🚀*\n"
-                 f"⬇️⬇️⬇️⬇️⬇️⬇️⬇️⬇️⬇️ \n" ),
+        text=render.round_start_text(game_state.current_team.name, game_state.round_time),
         parse_mode=ParseMode.MARKDOWN_V2
     )
 
-    await asyncio.sleep(3)
+def schedule_countdown(job_queue, chat_id: int, delay: float = None) -> None:
+    if delay is None:
+        delay = ROUND_COUNTDOWN
+    # a late countdown still has to start the round, however busy the loop was
+    job_queue.run_once(
+        begin_round, delay, chat_id=chat_id, name=f"countdown_{chat_id}", job_kwargs={'misfire_grace_time': None}
+    )
+
+def cancel_countdown(job_queue, chat_id: int) -> None:
+    for job in job_queue.get_jobs_by_name(f"countdown_{chat_id}"):
+        job.schedule_removal()
+
+async def begin_round(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """ The "get ready" countdown is over: run the timer and show the first word """
+    chat_id = context.job.chat_id
+    async with CHAT_LOCKS.hold(chat_id):
+        game_state = GAME_STATES.get(chat_id)
+        if game_state is None or not game_state.in_game or not game_state.round.countdown:
+            return # the game was canceled in the meantime
+
+        game_state.start_round(time.time())
+        STORE.mark_dirty(chat_id)
+        await start_timer(chat_id, context)
+        await show_next_word(chat_id, context)
+
+async def set_num_teams(update: Update, context: ContextTypes.DEFAULT_TYPE, game_state: GameState) -> None:
+    try:
+        num_teams = int(update.message.text)
+    except ValueError:
+        await reply_text(update, "🚫 That's not a number. Try again:")
+        return
+    if not 2 <= num_teams <= 4:
+        await reply_text(update, "🚫 Please enter a number between 2 and 4.")
+        return
+    game_state.set_teams(num_teams)
+    await reply_text(
+        update,
+        f"✅ *{num_teams} teams* set\\.\n" \
+         "Now enter team names one by one, starting with the *first team*\\.",
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+
+async def set_team_name(update: Update, context: ContextTypes.DEFAULT_TYPE, game_state: GameState) -> None:
+    team_name = update.message.text.strip()
+    if not team_name:
+        await reply_text(update, "🚫 The team name cannot be empty. Please try again.")
+        return
+    if render.text_length(team_name) > render.MAX_TEAM_NAME_LENGTH:
+        await reply_text(update, f"🚫 The team name can have at most {render.MAX_TEAM_NAME_LENGTH} characters. Please try again.")
+        return
+    if game_state.name_next_team(team_name):
+        await reply_text(
+            update,
+            f"✏️ Enter the name for the next team:"
+        )
+    else:
+        await reply_text(
+            update,
+            "🕗 Now enter the round duration in seconds:"
+        )
+
+async def set_round_time(update: Update, context: ContextTypes.DEFAULT_TYPE, game_state: GameState) -> None:
+    try:
+        round_time = int(update.message.text)
+    except ValueError:
+        await reply_text(update, "🚫 This is not a number. Please enter the round duration in seconds:")
+        return
+    if round_time <= 0:
+        await reply_text(update, "🚫 The round time must be a positive number. Try again:")
+        return
+    game_state.set_round_time(round_time)
+    await reply_text(
+        update,
+        "🔢 Enter the number of explained words needed to win:"
+    )
 
-    # current round status is set to zero 
-    game_state['explained_words_count'] = 0
-    game_state['skipped_words_count'] = 0
-    game_state['explained_words'] = []
-    game_state['skipped_words'] = []
-    all_words = list(game_state['words'].keys())
-    sampled_words = random.sample(all_words, k=min(len(all_words), 50))
-    round_words_dict = {k: game_state['words'][k] for k in sampled_words}
-    game_state['current_round_words'] = round_words_dict
-    game_state['current_word_index'] = 0
+async def set_words_to_win(update: Update, context: ContextTypes.DEFAULT_TYPE, game_state: GameState) -> None:
+    try:
+        words_to_win = int(update.message.text)
+    except ValueError:
+        await reply_text(update, "🚫 This is not a number. Try again:")
+        return
+    if words_to_win <= 0:
+        await reply_text(update, "🚫 The number of words must be a positive number. Try again:")
+        return
+    game_state.start_game(words_to_win) # finish game settings
+    await reply_text(update, "✅ Game settings are complete!")
+    await start_round(update, context)
 
-    game_state['timer_start_time'] = time.time()
-    await start_timer(update, context)
-    await show_next_word(update, context)
+# setup step of the chat's game -> the handler of its answer
+SETUP_STEPS = {
+    'set_num_teams': set_num_teams,
+    'set_team_names': set_team_name,
+    'set_round_time': set_round_time,
+    'set_words_to_win': set_words_to_win
+}
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Here we process messages from the user depending on the current state"""
-    chat_id = update.effective_chat.id
-    if 'next_step' in context.user_data:
-        step = context.user_data['next_step']
-
-        if step == 'set_num_teams':
-            try:
-                num_teams = int(update.message.text)
-                if 2 <= num_teams <= 4:
-                    GAME_STATES[chat_id]['teams'] = [{'name': f'Team {i+1}', 'score': 0} for i in range(num_teams)]
-                    await update.message.reply_text(
-                        f"✅ *{num_teams} teams* set\\.\n" \
-                         "Now enter team names one by one, starting with the *first team*\\.",
-                        parse_mode=ParseMode.MARKDOWN_V2
-                    )
-                    context.user_data['current_team_naming_index'] = 0
-                    context.user_data['next_step'] = 'set_team_names'
-                else:
-                    await update.message.reply_text("🚫 Please enter a number between 2 and 4.")
-            except ValueError:
-                await update.message.reply_text("🚫 That's not a number. Try again:")
-
-        elif step == 'set_team_names':
-            current_index = context.user_data['current_team_naming_index']
-            team_name = update.message.text.strip()
-            if team_name:
-                GAME_STATES[chat_id]['teams'][current_index]['name'] = team_name
-                GAME_STATES[chat_id]['total_scores'][team_name] = 0
-                context.user_data['current_team_naming_index'] += 1
-
-                if context.user_data['current_team_naming_index'] < len(GAME_STATES[chat_id]['teams']):
-                    await update.message.reply_text(
-                        f"✏️ Enter the name for the next team:"
-                    )
-                else:
-                    del context.user_data['current_team_naming_index']
-                    await update.message.reply_text(
-                        "🕗 Now enter the round duration in seconds:"
-                    )
-                    context.user_data['next_step'] = 'set_round_time'
-            else:
-                await update.message.reply_text("🚫 The team name cannot be empty. Please try again.")
-
-        elif step == 'set_round_time':
-            try:
-                round_time = int(update.message.text)
-                if round_time > 0:
-                    GAME_STATES[chat_id]['round_time'] = round_time
-                    await update.message.reply_text(
-                        "🔢 Enter the number of explained words needed to win:"
-                    )
-                    context.user_data['next_step'] = 'set_words_to_win'
-                else:
-                    await update.message.reply_text("🚫 The round time must be a positive number. Try again:")
-            except ValueError:
-                await update.message.reply_text("🚫 This is not a number. Please enter the round duration in seconds:")
-
-        elif step == 'set_words_to_win':
-            try:
-                words_to_win = int(update.message.text)
-                if words_to_win > 0:
-                    GAME_STATES[chat_id]['words_to_win'] = words_to_win
-                    del context.user_data['next_step'] # finish game settings 
-                    GAME_STATES[chat_id]['in_game'] = True
-                    await update.message.reply_text("✅ Game settings are complete!")
-                    await start_round(update, context)
-                else:
-                    await update.message.reply_text("🚫 The number of words must be a positive number. Try again:")
-            except ValueError:
-                await update.message.reply_text("🚫 This is not a number. Try again:")
+    """ A setup answer: only messages of chats with a pending step pass SETUP_ANSWER """
+    game_state = GAME_STATES[update.effective_chat.id]
+    await SETUP_STEPS[game_state.setup_step](update, context, game_state)
 
 async def set_difficulty(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Set up difficulty and suggest to choose the number of teams."""
@@ -357,13 +436,14 @@ async def set_difficulty(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
     chat_id = query.message.chat_id
     difficulty = query.data.split('_')[2]
-    GAME_STATES[chat_id]['difficulty'] = difficulty
-    GAME_STATES[chat_id]['words'] = load_words(GAME_STATES[chat_id]['language'], difficulty, LOGGER)
+    # games only reference the shared pack, the words are never copied
+    GAME_STATES[chat_id].set_pack(difficulty)
+    get_pack(GAME_STATES[chat_id].pack_id, LOGGER)
 
-    await query.edit_message_text(
+    await edit_text(
+        query,
         "🧑‍🤝‍🧑 Enter the number of teams (from 2 to 4):"
     )
-    context.user_data['next_step'] = 'set_num_teams'
 
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """ Set langiage and complexity """
@@ -371,7 +451,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await query.answer()
     chat_id = query.message.chat_id
     lang_code = query.data.split('_')[2]
-    GAME_STATES[chat_id]['language'] = lang_code
+    GAME_STATES[chat_id].language = lang_code
 
     keyboard = [
         [InlineKeyboardButton("🟢 Easy", callback_data='set_difficulty_easy')],
@@ -379,7 +459,8 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         [InlineKeyboardButton("🔴 Hard", callback_data='set_difficulty_hard')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
+    await edit_text(
+        query,
         "🎯 Select the difficulty level:",
         reply_markup=reply_markup
     )
@@ -389,14 +470,15 @@ async def start_game_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     chat_id = query.message.chat_id
-    GAME_STATES[chat_id] = DEFAULT_GAME_STATE.copy()
+    new_game(context.job_queue, chat_id)
 
     keyboard = [
         [InlineKeyboardButton("🇩🇪 Deutsch", callback_data='set_lang_de')],
         [InlineKeyboardButton("🇬🇧 English", callback_data='set_lang_en')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
+    await edit_text(
+        query,
         "🌐 *Choose the game language*:",
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN_V2
@@ -405,21 +487,232 @@ async def start_game_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Runs the app and suggest to start the game"""
     chat_id = update.effective_chat.id
-    GAME_STATES[chat_id] = DEFAULT_GAME_STATE.copy()
+    new_game(context.job_queue, chat_id)
 
     keyboard = [[InlineKeyboardButton("Start a new game", callback_data='start_game')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
+    await reply_text(
+        update,
         "👋 Hi\\! I'm a bot for playing *TalkFast* 🎉\n\n"
         "Click *START NEW GAME* 🔄 to get started\\!",
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN_V2
     )
 
-def main() -> None:
-    # create basic application
-    application = Application.builder().token(BOT_TOKEN).build()
+async def reload_word_packs(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """ Pick up word pack files changed on disk """
+    reloaded = reload_changed_packs(LOGGER)
+    if reloaded:
+        LOGGER.info(f"Word packs reloaded: {', '.join(reloaded)}")
+
+def game_update(update: object) -> bool:
+    """ False for chatter: a message that is neither a command nor a setup answer the chat owes """
+    if not isinstance(update, Update) or update.message is None:
+        return True
+    return filters.COMMAND.check_update(update) or SETUP_ANSWER.check_update(update)
+
+async def count_incoming_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    count_update()
+
+async def log_metrics(context: ContextTypes.DEFAULT_TYPE) -> None:
+    LOGGER.info(f"Metrics:\n{summary()}")
+
+async def dump_profile(context: ContextTypes.DEFAULT_TYPE) -> None:
+    context.job.data.dump(PROFILE_OUTPUT)
+
+async def start_metrics_server(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await context.job.data.start()
+
+async def stop_services(application: Application) -> None:
+    """ Stop the outbound queue and the metrics server with the application """
+    await OUTBOX.stop()
+    server = application.bot_data.get('metrics_server')
+    if server is not None:
+        await server.stop()
+
+def register_game_gauges(application: Application) -> None:
+    register_gauge("games", "Games held in memory", lambda: len(GAME_STATES))
+    register_gauge(
+        "ignored_updates_total", "Chat messages dropped before the handlers",
+        lambda: application.update_processor.ignored, kind="counter"
+    )
+    register_gauge("active_games", "Games in progress", lambda: sum(g.in_game for g in GAME_STATES.values()))
+    register_gauge("active_rounds", "Rounds with a running timer", lambda: len(TIMERS.rounds))
+    register_gauge("busy_chats", "Chats with an update or round end in progress", lambda: len(CHAT_LOCKS))
+    register_gauge("dirty_games", "Games waiting to be persisted", lambda: len(STORE.dirty))
+    for reason in ('idle', 'lru'):
+        register_gauge(
+            f"evicted_{reason}_total", f"Games dropped by the evictor: {reason}",
+            lambda reason=reason: EVICTOR.counters[reason], kind="counter"
+        )
+    register_gauge("evicted_bytes_total", "Approximate bytes freed by evictions", lambda: EVICTOR.counters['bytes'], kind="counter")
+    register_gauge("outbox_queued", "Bot API calls waiting in the outbound queue", lambda: len(OUTBOX))
+    for name in ('sent', 'superseded', 'retried', 'failed'):
+        register_gauge(
+            f"outbox_{name}_total", f"Calls of the outbound queue: {name}",
+            lambda name=name: OUTBOX.counters[name], kind="counter"
+        )
+    for name in ('recorded', 'flushed', 'rebuilt'):
+        register_gauge(
+            f"word_stats_{name}_total", f"Word statistics: {name}",
+            lambda name=name: WORD_STATS.counters[name], kind="counter"
+        )
+    for name in ('sent', 'suppressed', 'throttled', 'failed', 'expired'):
+        register_gauge(
+            f"timer_{name}_total", f"Round timer countdown edits and expiries: {name}",
+            lambda name=name: TIMERS.counters[name], kind="counter"
+        )
+
+async def mark_chat_dirty(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """ Runs after the game handlers: the chat's game has to be persisted and is in use.
+    Chats without a game are not tracked, a canceled or won game is dropped right away """
+    if update.effective_chat and update.effective_chat.id in GAME_STATES:
+        STORE.mark_dirty(update.effective_chat.id)
+        EVICTOR.touch(update.effective_chat.id)
+
+async def expired_game(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """ A button of a chat whose game is gone """
+    await update.callback_query.answer("⌛ This game has expired. Start a new one with /start.")
+
+def new_game(job_queue, chat_id: int) -> GameState:
+    """ Replace the chat's game with a new one, the timer and countdown of the old one stop """
+    TIMERS.remove(chat_id)
+    cancel_countdown(job_queue, chat_id)
+    game_state = GAME_STATES[chat_id] = GameState()
+    return game_state
+
+def drop_game(job_queue, chat_id: int) -> int:
+    """ Remove a game with its timer and countdown, also from the store. Returns the freed bytes """
+    game_state = GAME_STATES.pop(chat_id, None)
+    TIMERS.remove(chat_id)
+    cancel_countdown(job_queue, chat_id)
+    EVICTOR.forget(chat_id)
+    STORE.mark_dirty(chat_id) # persisted as a deletion
+    return game_state.memory_size() if game_state is not None else 0
+
+async def evict_games(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """ Drop games idle for longer than GAME_IDLE_TTL and the oldest ones above MAX_GAMES """
+    busy = lambda chat_id: chat_id in CHAT_LOCKS or GAME_STATES[chat_id].round_in_progress # noqa: E731
+    evicted = EVICTOR.select(GAME_STATES, busy)
+    reclaimed = 0
+    for chat_id, reason in evicted:
+        reclaimed += drop_game(context.job_queue, chat_id)
+        context.application.drop_chat_data(chat_id)
+        EVICTOR.counters[reason] += 1
+    EVICTOR.counters['bytes'] += reclaimed
+    if evicted:
+        LOGGER.info(f"Evicted {len(evicted)} games (~{reclaimed / 1024:.1f} KiB), {len(GAME_STATES)} games left")
+
+async def persist_game_states(context: ContextTypes.DEFAULT_TYPE) -> None:
+    STORE.persist(GAME_STATES, GameState.to_dict, GameState.deck_snapshot)
+
+async def flush_word_stats(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await WORD_STATS.flush()
+
+def restore_games(job_queue, snapshots: dict) -> int:
+    """ Load saved games and re-arm the timers of rounds in progress, returns the number of rounds """
+    restored_rounds = 0
+    for chat_id, data in snapshots.items():
+        game_state = GameState.from_dict(data)
+        GAME_STATES[chat_id] = game_state
+        EVICTOR.touch(chat_id)
+        if game_state.in_game and game_state.round.active:
+            # an already expired round is finished on the first timer tick
+            TIMERS.add(
+                chat_id,
+                game_state.round.timer_message_id,
+                game_state.round.start_time,
+                game_state.round_time
+            )
+            restored_rounds += 1
+        elif game_state.in_game and game_state.round.countdown:
+            schedule_countdown(job_queue, chat_id, delay=0)
+            restored_rounds += 1
+    return restored_rounds
+
+async def restore_game_states(application: Application) -> None:
+    restored_rounds = restore_games(application.job_queue, STORE.load_all())
+    LOGGER.info(f"Restored {len(GAME_STATES)} games, {restored_rounds} rounds in progress")
+
+def share_outbox(workers: int) -> None:
+    """ Sharded mode: the workers share the bot's global budget """
+    OUTBOX.set_limits(OUTBOX_RATE / max(workers, 1), OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+
+async def release_games(application: Application, owns, workers: int) -> None:
+    """ Sharded mode: save and drop the games this worker no longer owns """
+    share_outbox(workers)
+    released = [chat_id for chat_id in GAME_STATES if not owns(chat_id)]
+    for chat_id in released:
+        STORE.mark_dirty(chat_id)
+    STORE.persist(GAME_STATES, GameState.to_dict, GameState.deck_snapshot)
+    STORE.flush() # the new owner reads them right after this
+    for chat_id in released:
+        TIMERS.remove(chat_id)
+        cancel_countdown(application.job_queue, chat_id)
+        EVICTOR.forget(chat_id)
+        del GAME_STATES[chat_id]
+    if released:
+        LOGGER.info(f"Released {len(released)} games")
+
+async def adopt_games(application: Application, owns, workers: int) -> None:
+    """ Sharded mode: load the games this worker gained from the shared store """
+    share_outbox(workers)
+    snapshots = {
+        chat_id: data for chat_id, data in STORE.load_all().items()
+        if owns(chat_id) and chat_id not in GAME_STATES
+    }
+    restored_rounds = restore_games(application.job_queue, snapshots)
+    if snapshots:
+        LOGGER.info(f"Adopted {len(snapshots)} games, {restored_rounds} rounds in progress")
+
+async def close_store(application: Application) -> None:
+    STORE.persist(GAME_STATES, GameState.to_dict, GameState.deck_snapshot)
+    STORE.close()
+    await WORD_STATS.flush()
+    WORD_STATS.store.close()
+
+def build_application(
+    request: BaseRequest = None,
+    metrics_port: int = METRICS_PORT,
+    profiler: SamplingProfiler = None
+) -> Application:
+    """ Application with all handlers and jobs, `request` replaces the HTTP layer """
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request or CountingRequest())
+        .concurrent_updates(ChatUpdateProcessor(CONCURRENT_UPDATES, wanted=game_update))
+        .post_init(restore_game_states)
+        .post_stop(stop_services)
+        .post_shutdown(close_store)
+        .build()
+    )
+    OUTBOX.set_limits(OUTBOX_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
     application.job_queue.run_once(set_default_commands, 0)
+    application.job_queue.run_repeating(reload_word_packs, interval=300, first=300)
+    TIMERS.start(application.job_queue, on_expire=end_round_force)
+    application.job_queue.run_repeating(
+        persist_game_states, interval=STATE_PERSIST_INTERVAL, first=STATE_PERSIST_INTERVAL
+    )
+    application.job_queue.run_repeating(
+        flush_word_stats, interval=WORD_STATS_FLUSH_INTERVAL, first=WORD_STATS_FLUSH_INTERVAL
+    )
+    if GAME_IDLE_TTL or MAX_GAMES:
+        application.job_queue.run_repeating(evict_games, interval=EVICTION_INTERVAL, first=EVICTION_INTERVAL)
+    register_game_gauges(application)
+    if METRICS_LOG_INTERVAL:
+        application.job_queue.run_repeating(log_metrics, interval=METRICS_LOG_INTERVAL, first=METRICS_LOG_INTERVAL)
+    if metrics_port:
+        server = MetricsServer(METRICS_LISTEN, metrics_port, profiler)
+        application.bot_data['metrics_server'] = server
+        application.job_queue.run_once(start_metrics_server, 0, data=server)
+    if profiler is not None:
+        application.job_queue.run_repeating(
+            dump_profile, interval=PROFILE_DUMP_INTERVAL, first=PROFILE_DUMP_INTERVAL, data=profiler
+        )
+
+    # buttons of evicted games, before the game handlers
+    application.add_handler(ExpiredGameHandler(expired_game, lambda chat_id: chat_id in GAME_STATES, ('start_game',)))
 
     # commands processing 
     application.add_handler(CommandHandler("help", help_command))
@@ -431,13 +724,94 @@ def main() -> None:
     application.add_handler(CallbackQueryHandler(set_language, pattern='^set_lang_'))
     application.add_handler(CallbackQueryHandler(set_difficulty, pattern='^set_difficulty_'))
     application.add_handler(CallbackQueryHandler(handle_word_action, pattern='^word_'))
-    application.add_handler(CallbackQueryHandler(start_next_round_callback, pattern='^start_next_round$'))
+    application.add_handler(CallbackQueryHandler(start_next_round_callback, pattern='^start_next_round'))
 
     # user input processing (text)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(SETUP_ANSWER & filters.TEXT & ~filters.COMMAND, handle_message))
+
+    # every update is counted before it reaches the game handlers
+    application.add_handler(TypeHandler(Update, count_incoming_update), group=-1)
+
+    # every processed update may change the chat's game
+    application.add_handler(TypeHandler(Update, mark_chat_dirty), group=1)
+
+    # latency of every game handler
+    for handler in application.handlers[0]:
+        handler.callback = timed(handler.callback)
+    return application
+
+def start_profiler() -> SamplingProfiler:
+    """ Sample the calling thread, which runs the event loop afterwards """
+    if not PROFILE_INTERVAL:
+        return None
+    profiler = SamplingProfiler(PROFILE_INTERVAL)
+    profiler.start()
+    return profiler
+
+def run_shard_worker(shard_id: int, inbox, acks, request: BaseRequest = None) -> None:
+    """ Entry point of a worker process in the sharded mode """
+    global STORE, WORD_STATS
+    STORE = create_store(STATE_STORE, STATE_DB_PATH)
+    WORD_STATS = WordStats(create_stats_store(STATE_STORE, STATE_DB_PATH), WORD_WEIGHTING)
+    preload_packs(LOGGER)
+    metrics_port = METRICS_PORT + 1 + shard_id if METRICS_PORT else None
+    application = build_application(request, metrics_port=metrics_port, profiler=start_profiler())
+    share_outbox(SHARD_WORKERS) # until the first rebalance tells the actual number
+    asyncio.run(serve_shard(application, shard_id, inbox, acks, release_games, adopt_games))
+
+def main() -> None:
+    global STORE, WORD_STATS
+
+    # sharded mode: this process only receives updates, the workers play the games
+    if UPDATE_MODE == "webhook" and SHARD_WORKERS > 1:
+        if STATE_STORE != "sqlite":
+            raise ValueError("SHARD_WORKERS needs STATE_STORE = 'sqlite', the workers share the games through it")
+        router = ShardRouter(run_shard_worker)
+        server = WebhookServer(
+            router.dispatch,
+            host=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_concurrency=WEBHOOK_MAX_CONCURRENCY,
+            record_path=WEBHOOK_RECORD_PATH
+        )
+        bot = Bot(BOT_TOKEN, request=CountingRequest())
+        metrics_server = None
+        if METRICS_PORT:
+            register_gauge("shard_workers", "Worker processes in the ring", lambda: len(router.ring))
+            register_gauge("routed_total", "Updates routed to workers", lambda: router.counters['routed'], kind="counter")
+            register_gauge("rebalances_total", "Ring changes", lambda: router.counters['rebalances'], kind="counter")
+            register_gauge("webhook_rejected_total", "Rejected webhook requests", lambda: server.counters['rejected'], kind="counter")
+            metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT)
+        asyncio.run(serve_sharded(
+            router, SHARD_WORKERS, server, bot, WEBHOOK_URL, ALLOWED_UPDATES, metrics_server=metrics_server
+        ))
+        return
+
+    STORE = create_store(STATE_STORE, STATE_DB_PATH)
+    WORD_STATS = WordStats(create_stats_store(STATE_STORE, STATE_DB_PATH), WORD_WEIGHTING)
+
+    # word packs are parsed once and shared by all games
+    preload_packs(LOGGER)
+
+    # create basic application
+    application = build_application(profiler=start_profiler())
 
     # run bot 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if UPDATE_MODE == "webhook":
+        server = WebhookServer(
+            application_dispatcher(application),
+            host=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_concurrency=WEBHOOK_MAX_CONCURRENCY,
+            record_path=WEBHOOK_RECORD_PATH
+        )
+        asyncio.run(serve_webhook(application, server, WEBHOOK_URL, ALLOWED_UPDATES))
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
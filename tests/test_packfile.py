@@ -0,0 +1,26 @@
+import pytest
+from data.packfile import BinaryWordPack, compile_pack
+
+
+ENTRIES = [("a", "b"), ("c", "d")]
+
+
+def write_pack(tmp_path, data: bytes) -> str:
+    path = tmp_path / "test_words.pack"
+    path.write_bytes(data)
+    return str(path)
+
+def test_compiled_pack_round_trip(tmp_path):
+    pack = BinaryWordPack("test", write_pack(tmp_path, compile_pack(ENTRIES)), 0.0)
+    assert [pack[i] for i in range(len(pack))] == ENTRIES
+
+@pytest.mark.parametrize("cut", [
+    lambda data: b"",
+    lambda data: data[:10], # inside the header
+    lambda data: data[:30], # inside the offsets
+    lambda data: data[:-1], # inside the blob
+    lambda data: data + b"x",
+])
+def test_malformed_pack_is_rejected(tmp_path, cut):
+    with pytest.raises(ValueError):
+        BinaryWordPack("test", write_pack(tmp_path, cut(compile_pack(ENTRIES))), 0.0)
@@ -0,0 +1,61 @@
+import pytest
+from data.build_packs import find_pack_ids, read_entries, render_errors
+from data.packfile import escape
+from game.render import (
+    MAX_MESSAGE_LENGTH, MAX_TEAM_NAME_LENGTH, final_scores_text, fits, markdown_v2_errors,
+    round_start_text, round_summary_text, summary_line, win_text,
+)
+from game.state import RoundState, Team
+
+
+@pytest.mark.parametrize("pack_id", find_pack_ids())
+def test_shipped_pack_renders(pack_id):
+    assert render_errors(pack_id, read_entries(pack_id)) == []
+
+def test_special_characters_are_escaped():
+    entries = [("e.g. (sth)", "z.B. [etw]"), ("a_b*c", "~`>#+-=|{}!")]
+    assert render_errors("test", entries) == []
+    assert markdown_v2_errors(round_start_text("Team *1* (best)!", 60)) == []
+
+@pytest.mark.parametrize("text", [
+    "plain text",
+    "*bold* _italic_ __underline__ ~strike~ ||spoiler||",
+    "*bold _italic_*",
+    "escaped \\. \\! \\( \\)",
+])
+def test_valid_markdown(text):
+    assert markdown_v2_errors(text) == []
+
+@pytest.mark.parametrize("text, error", [
+    ("ends with a dot.", "'.' must be escaped"),
+    ("*never closed", "'*' is never closed"),
+    ("*bold _crossed* italic_", "'*' closes over '_'"),
+    ("\\ü", "backslash does not escape an ASCII character"),
+    ("trailing \\", "backslash does not escape an ASCII character"),
+])
+def test_invalid_markdown(text, error):
+    assert any(error in message for message in markdown_v2_errors(text))
+
+def test_length_counts_utf16_units():
+    assert markdown_v2_errors("a" * MAX_MESSAGE_LENGTH) == []
+    assert markdown_v2_errors("*" + "a" * MAX_MESSAGE_LENGTH + "*") == []
+    assert markdown_v2_errors("😀" * (MAX_MESSAGE_LENGTH // 2 + 1)) != []
+
+def test_long_round_end_fits_one_message():
+    teams = [Team("😀" * (MAX_TEAM_NAME_LENGTH // 2), score) for score in range(4)]
+    words = [(f"Sehr_langes_Wort_{index}", f"a very (long) translation {index}") for index in range(300)]
+    round_state = RoundState(
+        explained_words=words,
+        skipped_words=words,
+        explained_lines=[summary_line(True, escape(w), escape(t)) for w, t in words],
+        skipped_lines=[summary_line(False, escape(w), escape(t)) for w, t in words],
+    )
+    text = "\n\n".join([
+        "⌛️ Time's up\\!",
+        round_summary_text(teams[0], round_state, 300),
+        win_text(teams[0]),
+        final_scores_text(teams),
+    ])
+    assert fits(text)
+    assert markdown_v2_errors(text) == []
+    assert "… and " in text
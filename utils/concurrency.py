@@ -0,0 +1,97 @@
+import asyncio
+import contextlib
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatLocks:
+    """ One asyncio.Lock per chat, created on demand and dropped when idle.
+
+    Everything that changes a game (update handlers, the timer expiry, the
+    countdown job) runs under the lock of its chat, so a chat sees its
+    updates strictly one after another while other chats run in parallel.
+    """
+
+    def __init__(self) -> None:
+        self._locks = {} # chat_id -> [lock, number of holders and waiters]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def __contains__(self, chat_id: int) -> bool:
+        """ True while an update or a round end of the chat runs or waits """
+        return chat_id in self._locks
+
+    @contextlib.asynccontextmanager
+    async def hold(self, chat_id: int):
+        entry = self._locks.get(chat_id)
+        if entry is None:
+            entry = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat_id]
+
+
+CHAT_LOCKS = ChatLocks()
+
+UNBOUNDED = 2 ** 31 - 1 # concurrency given to PTB's own semaphore
+
+
+def update_chat_id(update: object) -> int:
+    """ Chat an update belongs to, None if it belongs to none """
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    """ Processes updates of different chats concurrently and updates of the
+    same chat in arrival order.
+
+    The chat lock is taken before a concurrency slot, so a burst in one chat
+    waits on its own lock instead of occupying the slots of other chats.
+    Updates for which `wanted(update)` is False, e.g. chatter in a group,
+    are dropped before any of that and no handler runs for them.
+
+    PTB takes its own slot before do_process_update(), the only hook it
+    allows to override, so that one is unbounded and the real slots are
+    taken in there, after the chat lock.
+    """
+
+    def __init__(self, max_concurrent_updates: int, locks: ChatLocks = CHAT_LOCKS, wanted=None) -> None:
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(UNBOUNDED)
+        self.slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.locks = locks
+        self.wanted = wanted
+        self.ignored = 0
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self.wanted is not None and not self.wanted(update):
+            coroutine.close()
+            self.ignored += 1
+            return
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            async with self.slots:
+                await coroutine
+            return
+        async with self.locks.hold(chat_id):
+            async with self.slots:
+                await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
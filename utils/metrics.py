@@ -0,0 +1,249 @@
+import time
+import asyncio
+import functools
+from collections import Counter
+from telegram.request import HTTPXRequest
+from utils.logger import LOGGER
+
+
+PREFIX = "alias" # prefix of every exported metric name
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # seconds
+
+
+class Histogram:
+    """ Cumulative histogram in the Prometheus layout """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, fraction: float) -> float:
+        """ Upper bound of the bucket holding the quantile """
+        rank = self.count * fraction
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+
+# Outbound Bot API calls by method, e.g. {'sendMessage': 10}
+API_CALLS = Counter()
+# Failed Bot API calls by (method, error), e.g. {('editMessageText', 'http_400'): 2}
+API_ERRORS = Counter()
+# Processed updates, API_CALLS / UPDATES is the number of calls per update
+UPDATES = Counter()
+# Stale or repeated button presses answered without touching the game, by button
+REJECTED_PRESSES = Counter()
+# Handler latency: name -> Histogram
+LATENCIES = {}
+# Delay of the round timer ticks behind their schedule
+TIMER_LAG = Histogram()
+# Values read at export time: name -> (help text, callable, "gauge" or "counter")
+GAUGES = {}
+
+
+def count_api_call(method: str) -> None:
+    API_CALLS[method] += 1
+
+def count_api_error(method: str, error: str) -> None:
+    API_ERRORS[(method, error)] += 1
+
+def count_update() -> None:
+    UPDATES['total'] += 1
+
+def count_rejected_press(button: str) -> None:
+    REJECTED_PRESSES[button] += 1
+
+def observe(name: str, seconds: float) -> None:
+    latency = LATENCIES.get(name)
+    if latency is None:
+        latency = LATENCIES[name] = Histogram()
+    latency.observe(seconds)
+
+def observe_timer_lag(seconds: float) -> None:
+    TIMER_LAG.observe(max(seconds, 0.0))
+
+def register_gauge(name: str, help_text: str, read, kind: str = "gauge") -> None:
+    """ Export read() at export time, e.g. the number of active games """
+    GAUGES[name] = (help_text, read, kind)
+
+def timed(callback, name: str = None):
+    """ Wrap a handler to measure its latency """
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            observe(name, time.perf_counter() - started)
+    return wrapper
+
+def read_gauges() -> dict:
+    values = {}
+    for name, (_, read, _) in GAUGES.items():
+        try:
+            values[name] = read()
+        except Exception as e:
+            LOGGER.warning(f"Gauge {name} can't be read: {e}")
+    return values
+
+def summary() -> str:
+    updates = UPDATES['total']
+    calls = sum(API_CALLS.values())
+    per_update = calls / updates if updates else 0.0
+    lines = [f"updates: {updates}, api calls: {calls} ({per_update:.2f} per update)"]
+    lines += [f"  {method}: {count}" for method, count in API_CALLS.most_common()]
+    lines += [f"  {method} failed, {error}: {count}" for (method, error), count in API_ERRORS.most_common()]
+    lines += [f"  stale {button} presses: {count}" for button, count in REJECTED_PRESSES.most_common()]
+    for name, histogram in sorted(LATENCIES.items()):
+        lines.append(
+            f"  {name}: {histogram.count} calls, {histogram.total / histogram.count * 1000:.1f} ms avg, "
+            f"p99 <= {histogram.quantile(0.99) * 1000:.0f} ms"
+        )
+    if TIMER_LAG.count:
+        lines.append(f"timer lag: p99 <= {TIMER_LAG.quantile(0.99) * 1000:.0f} ms, max {TIMER_LAG.max * 1000:.0f} ms")
+    gauges = read_gauges()
+    if gauges:
+        lines.append(", ".join(f"{name}: {value}" for name, value in gauges.items()))
+    return "\n".join(lines)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+def _histogram_lines(name: str, histogram: Histogram, **labels) -> list:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+    suffix = _labels(**labels) if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.total}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+def export_text() -> str:
+    """ All metrics in the Prometheus text exposition format """
+    lines = [
+        f"# HELP {PREFIX}_updates_total Updates processed",
+        f"# TYPE {PREFIX}_updates_total counter",
+        f"{PREFIX}_updates_total {UPDATES['total']}",
+        f"# HELP {PREFIX}_api_calls_total Bot API calls by method",
+        f"# TYPE {PREFIX}_api_calls_total counter",
+    ]
+    lines += [f"{PREFIX}_api_calls_total{_labels(method=method)} {count}" for method, count in sorted(API_CALLS.items())]
+    lines += [
+        f"# HELP {PREFIX}_api_errors_total Failed Bot API calls by method and error",
+        f"# TYPE {PREFIX}_api_errors_total counter",
+    ]
+    lines += [
+        f"{PREFIX}_api_errors_total{_labels(method=method, error=error)} {count}"
+        for (method, error), count in sorted(API_ERRORS.items())
+    ]
+    lines += [
+        f"# HELP {PREFIX}_rejected_presses_total Stale or repeated button presses by button",
+        f"# TYPE {PREFIX}_rejected_presses_total counter",
+    ]
+    lines += [
+        f"{PREFIX}_rejected_presses_total{_labels(button=button)} {count}"
+        for button, count in sorted(REJECTED_PRESSES.items())
+    ]
+    lines += [
+        f"# HELP {PREFIX}_handler_seconds Handler latency",
+        f"# TYPE {PREFIX}_handler_seconds histogram",
+    ]
+    for name, histogram in sorted(LATENCIES.items()):
+        lines += _histogram_lines(f"{PREFIX}_handler_seconds", histogram, handler=name)
+    lines += [
+        f"# HELP {PREFIX}_timer_lag_seconds Delay of the round timer ticks behind their schedule",
+        f"# TYPE {PREFIX}_timer_lag_seconds histogram",
+    ]
+    lines += _histogram_lines(f"{PREFIX}_timer_lag_seconds", TIMER_LAG)
+    for name, value in read_gauges().items():
+        help_text, _, kind = GAUGES[name]
+        lines += [
+            f"# HELP {PREFIX}_{name} {help_text}",
+            f"# TYPE {PREFIX}_{name} {kind}",
+            f"{PREFIX}_{name} {value}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """ Local HTTP endpoint: GET /metrics for Prometheus, GET /profile for the
+    hot stacks of the sampling profiler when it is running """
+
+    def __init__(self, host: str, port: int, profiler=None) -> None:
+        self.host = host
+        self.port = port
+        self.profiler = profiler
+        self.server = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        LOGGER.info(f"Metrics served on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def _render(self, path: str) -> tuple:
+        if path == "/metrics":
+            return "200 OK", "text/plain; version=0.0.4", export_text()
+        if path == "/profile" and self.profiler is not None:
+            return "200 OK", "text/plain", self.profiler.collapsed()
+        return "404 Not Found", "text/plain", ""
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            method, path = (head.decode('latin-1').split(" ") + ["", ""])[:2]
+            status, content_type, body = self._render(path) if method == "GET" else ("405 Method Not Allowed", "text/plain", "")
+            payload = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+
+class CountingRequest(HTTPXRequest):
+    """ HTTPXRequest that counts Bot API calls by method and their failures """
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> tuple:
+        endpoint = url.rsplit('/', 1)[-1]
+        count_api_call(endpoint)
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            count_api_error(endpoint, type(e).__name__)
+            raise
+        if status >= 400:
+            count_api_error(endpoint, f"http_{status}")
+        return status, payload
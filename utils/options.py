@@ -0,0 +1,54 @@
+import config
+
+# Optional settings. Defaults are used unless they are set in config.py
+
+# Where games are persisted: "sqlite" survives restarts, "memory" does not
+STATE_STORE = getattr(config, "STATE_STORE", "sqlite")
+STATE_DB_PATH = getattr(config, "STATE_DB_PATH", "game_states.db")
+STATE_PERSIST_INTERVAL = getattr(config, "STATE_PERSIST_INTERVAL", 1) # seconds
+
+# How updates are received: "polling" or "webhook"
+UPDATE_MODE = getattr(config, "UPDATE_MODE", "polling")
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", None) # public https url registered at Telegram
+WEBHOOK_LISTEN = getattr(config, "WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8443)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None)
+WEBHOOK_MAX_CONCURRENCY = getattr(config, "WEBHOOK_MAX_CONCURRENCY", 64)
+WEBHOOK_RECORD_PATH = getattr(config, "WEBHOOK_RECORD_PATH", None) # append received updates as JSON lines
+# Webhook mode only: worker processes sharing the chats, more than 1 needs the sqlite store
+SHARD_WORKERS = getattr(config, "SHARD_WORKERS", 1)
+
+# Games without any activity for this many seconds are dropped, 0 keeps them forever
+GAME_IDLE_TTL = getattr(config, "GAME_IDLE_TTL", 12 * 3600)
+# Above this many games the least recently active ones are dropped, 0 means no limit
+MAX_GAMES = getattr(config, "MAX_GAMES", 100000)
+EVICTION_INTERVAL = getattr(config, "EVICTION_INTERVAL", 60) # seconds between sweeps
+
+# Updates handled at the same time, updates of one chat always run one after another
+CONCURRENT_UPDATES = getattr(config, "CONCURRENT_UPDATES", 256)
+
+# Outbound Bot API calls of the games: per second for the whole bot and per chat, 0 means no limit.
+# Word cards go first, then round messages, then countdown edits; RetryAfter is honoured on top
+OUTBOX_RATE = getattr(config, "OUTBOX_RATE", 30)
+OUTBOX_CHAT_RATE = getattr(config, "OUTBOX_CHAT_RATE", 5)
+OUTBOX_CHAT_BURST = getattr(config, "OUTBOX_CHAT_BURST", 10)
+
+# Explain and skip counts per word are written to the state store's database at this interval
+WORD_STATS_FLUSH_INTERVAL = getattr(config, "WORD_STATS_FLUSH_INTERVAL", 60) # seconds
+# How rounds are dealt: None shuffles uniformly, "skipped" favours words players tend to skip,
+# "explained" favours words that usually get explained
+WORD_WEIGHTING = getattr(config, "WORD_WEIGHTING", None)
+
+# Edit the word card in place instead of deleting it and sending a new one
+LIVE_WORD_CARD = getattr(config, "LIVE_WORD_CARD", False)
+METRICS_LOG_INTERVAL = getattr(config, "METRICS_LOG_INTERVAL", 300) # seconds, 0 turns it off
+
+# Local Prometheus endpoint, GET http://METRICS_LISTEN:METRICS_PORT/metrics; None turns it off.
+# In the sharded mode worker N listens on METRICS_PORT + 1 + N
+METRICS_LISTEN = getattr(config, "METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = getattr(config, "METRICS_PORT", None)
+# Sampling profiler of the event loop: seconds between samples, 0 turns it off
+PROFILE_INTERVAL = getattr(config, "PROFILE_INTERVAL", 0)
+PROFILE_DUMP_INTERVAL = getattr(config, "PROFILE_DUMP_INTERVAL", 60) # seconds between logged profiles
+PROFILE_OUTPUT = getattr(config, "PROFILE_OUTPUT", None) # collapsed stacks for flamegraph.pl / speedscope
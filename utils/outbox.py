@@ -0,0 +1,227 @@
+import time
+import heapq
+import asyncio
+import itertools
+from datetime import timedelta
+from telegram.error import RetryAfter
+from utils.ratelimit import TokenBucket
+from utils.logger import LOGGER
+
+
+# Priority classes, lower goes first
+CARD = 0 # the next word, the players are waiting for it
+SUMMARY = 1 # round start and round end messages
+COSMETIC = 2 # countdown edits, a newer one replaces a queued one
+
+MAX_RETRIES = 3 # RetryAfter answers before a COSMETIC call is given up, the others retry until sent
+PRUNE_EVERY = 1000 # calls between sweeps of the idle per-chat budgets
+
+
+class OutboundCall:
+    __slots__ = ("priority", "seq", "chat_id", "method", "kwargs", "key", "future", "retries")
+
+    def __init__(self, priority: int, seq: int, chat_id: int, method, kwargs: dict, key) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.key = key
+        self.future = asyncio.get_running_loop().create_future()
+        self.retries = 0
+
+    def __lt__(self, other: "OutboundCall") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Outbox:
+    """ Sends the Bot API calls of the games in priority order.
+
+    A chat has at most one call in flight, so its messages keep their order
+    within a priority class, and a chat waits while its budget is used up or
+    Telegram answered RetryAfter. Other chats go on meanwhile. Cards and round
+    messages carry the game's buttons and are retried until they are sent,
+    cosmetic calls are given up after MAX_RETRIES. A call queued with a `key`
+    is replaced by the next call with the same key, so only the newest
+    countdown edit of a round is ever sent. A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate: float = 30, chat_rate: float = 5, chat_burst: float = 10) -> None:
+        self.set_limits(rate, chat_rate, chat_burst)
+        self.queue = [] # heap of calls whose chat may send
+        self.waiting = {} # chat_id -> [call, ...] of a busy or blocked chat
+        self.busy = set() # chats with a call in flight
+        self.blocked = {} # chat_id -> monotonic time the chat may send again
+        self.chat_buckets = {} # chat_id -> TokenBucket
+        self.pending = {} # key -> the queued call with that key
+        self.sending = set() # tasks of the calls in flight
+        self.seq = itertools.count()
+        self.resume = None # timer handle while the global budget is used up
+        self.counters = {'sent': 0, 'superseded': 0, 'retried': 0, 'failed': 0}
+
+    def set_limits(self, rate: float, chat_rate: float, chat_burst: float) -> None:
+        self.bucket = TokenBucket(rate, max(rate, 1)) if rate else None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+
+    def __len__(self) -> int:
+        return len(self.queue) + sum(len(calls) for calls in self.waiting.values())
+
+    def submit(self, priority: int, method, key=None, **kwargs) -> asyncio.Future:
+        """ Queue method(**kwargs), a Bot method taking chat_id, e.g. bot.send_message.
+        The future gets its result, its error, or None if a newer call with the
+        same key replaced it """
+        call = OutboundCall(priority, next(self.seq), kwargs['chat_id'], method, kwargs, key)
+        if key is not None:
+            self.drop(key)
+            self.pending[key] = call
+        self._enqueue(call)
+        self._pump()
+        return call.future
+
+    def post(self, priority: int, method, key=None, **kwargs) -> None:
+        """ submit() without waiting for the result, failures are logged """
+        self.submit(priority, method, key, **kwargs).add_done_callback(self._log_failure)
+
+    def drop(self, key) -> None:
+        """ Forget the queued call with this key, e.g. the countdown edit of an ended round """
+        call = self.pending.pop(key, None)
+        if call is not None and not call.future.done():
+            call.future.set_result(None)
+            self.counters['superseded'] += 1
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            LOGGER.warning(f"Outbound call failed: {future.exception()}")
+
+    def _enqueue(self, call: OutboundCall) -> None:
+        if call.chat_id in self.busy or call.chat_id in self.blocked:
+            self.waiting.setdefault(call.chat_id, []).append(call)
+            return
+        heapq.heappush(self.queue, call)
+
+    def _release(self, chat_id: int) -> None:
+        """ The chat may send again: its waiting calls go back to the queue """
+        until = self.blocked.get(chat_id)
+        if until is not None:
+            if until > time.monotonic():
+                return
+            del self.blocked[chat_id]
+        for call in self.waiting.pop(chat_id, ()):
+            heapq.heappush(self.queue, call)
+        self._pump()
+
+    def _block(self, chat_id: int, seconds: float) -> None:
+        self.blocked[chat_id] = max(self.blocked.get(chat_id, 0.0), time.monotonic() + seconds)
+        asyncio.get_running_loop().call_later(seconds, self._release, chat_id)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _next_call(self) -> OutboundCall:
+        """ The most urgent call whose chat may send now, None if there is none """
+        while self.queue:
+            call = heapq.heappop(self.queue)
+            if call.future.done():
+                continue # replaced or canceled
+            if call.chat_id in self.busy or call.chat_id in self.blocked:
+                self.waiting.setdefault(call.chat_id, []).append(call)
+                continue
+            if self.chat_rate:
+                bucket = self._chat_bucket(call.chat_id)
+                if not bucket.consume():
+                    self.waiting.setdefault(call.chat_id, []).append(call)
+                    self._block(call.chat_id, bucket.delay())
+                    continue
+            return call
+        return None
+
+    def _pump(self) -> None:
+        """ Start every call that may go out now, called whenever that may change """
+        while self.resume is None:
+            if self.bucket is not None and self.bucket.delay() > 0:
+                self.resume = asyncio.get_running_loop().call_later(self.bucket.delay(), self._resume)
+                return
+            call = self._next_call()
+            if call is None:
+                return
+            if self.bucket is not None:
+                self.bucket.consume()
+            if call.key is not None and self.pending.get(call.key) is call:
+                del self.pending[call.key]
+            self.busy.add(call.chat_id)
+            task = asyncio.create_task(self._send(call))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    def _resume(self) -> None:
+        self.resume = None
+        self._pump()
+
+    async def _send(self, call: OutboundCall) -> None:
+        try:
+            result = await call.method(**call.kwargs)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            call.retries += 1
+            self._block(call.chat_id, delay)
+            if call.key is not None and call.key in self.pending:
+                call.future.set_result(None) # a newer call replaced it meanwhile
+                self.counters['superseded'] += 1
+            elif call.priority == COSMETIC and call.retries > MAX_RETRIES:
+                self.counters['failed'] += 1
+                call.future.set_exception(e)
+            else:
+                self.counters['retried'] += 1
+                if call.key is not None:
+                    self.pending[call.key] = call
+                self.waiting.setdefault(call.chat_id, []).append(call)
+        except Exception as e:
+            self.counters['failed'] += 1
+            if not call.future.done():
+                call.future.set_exception(e)
+        else:
+            self.counters['sent'] += 1
+            if not call.future.done():
+                call.future.set_result(result)
+            if self.counters['sent'] % PRUNE_EVERY == 0:
+                self._prune()
+        finally:
+            self.busy.discard(call.chat_id)
+            self._release(call.chat_id)
+
+    def _prune(self) -> None:
+        """ Drop the budgets of chats that are back at their full burst """
+        now = time.monotonic()
+        idle = [
+            chat_id for chat_id, bucket in self.chat_buckets.items()
+            if bucket.tokens + (now - bucket.updated_at) * bucket.rate >= bucket.capacity
+        ]
+        for chat_id in idle:
+            del self.chat_buckets[chat_id]
+
+    async def stop(self) -> None:
+        """ Cancel the calls in flight and the queued ones """
+        if self.resume is not None:
+            self.resume.cancel()
+            self.resume = None
+        for task in list(self.sending):
+            task.cancel()
+        calls = self.queue + [call for calls in self.waiting.values() for call in calls]
+        for call in calls:
+            call.future.cancel()
+        self.queue, self.waiting, self.pending = [], {}, {}
+        self.busy.clear()
+        self.blocked.clear()
+
+    def stats(self) -> dict:
+        return {'queued': len(self), **self.counters}
+
+
+# Global dispatcher of the game messages, limits are set by run_bot
+OUTBOX = Outbox()
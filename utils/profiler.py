@@ -0,0 +1,87 @@
+import os
+import sys
+import threading
+from collections import Counter
+from utils.logger import LOGGER
+
+
+MAX_DEPTH = 64 # frames kept per sampled stack
+
+
+class SamplingProfiler:
+    """ Opt-in statistical profiler of the event loop thread.
+
+    A daemon thread looks at the target thread's current stack every
+    `interval` seconds and counts it, so the cost is independent of how
+    many handlers run. Stacks are kept in the collapsed format of
+    flamegraph.pl and speedscope: "outer;inner;innermost count".
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: int = None) -> None:
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        LOGGER.info(f"Sampling profiler started, one sample every {self.interval * 1000:.1f} ms")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = self._collapse(frame)
+            with self._lock:
+                self.stacks[stack] += 1
+                self.samples += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def snapshot(self) -> tuple:
+        """ (stacks, samples) copied from the sampler thread """
+        with self._lock:
+            return Counter(self.stacks), self.samples
+
+    def collapsed(self) -> str:
+        stacks, _ = self.snapshot()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def hot_functions(self, top: int = 15) -> list:
+        """ [(frame, share of samples)] of the innermost frames seen most often """
+        stacks, samples = self.snapshot()
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [(frame, count / samples) for frame, count in leaves.most_common(top)] if samples else []
+
+    def dump(self, path: str = None) -> None:
+        """ Log the hottest frames and write all stacks to `path` """
+        lines = [f"{share * 100:5.1f}%  {frame}" for frame, share in self.hot_functions()]
+        LOGGER.info(f"Profile, {self.snapshot()[1]} samples:\n" + "\n".join(lines))
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.collapsed())
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stacks = Counter()
+            self.samples = 0
+
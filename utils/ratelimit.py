@@ -0,0 +1,31 @@
+import time
+
+
+class TokenBucket:
+    """ Classic token bucket: `rate` tokens per second, up to `capacity` saved """
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def consume(self, tokens: float = 1) -> bool:
+        """ Take tokens if available, never waits """
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1) -> float:
+        """ Seconds until `tokens` will be available """
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
@@ -0,0 +1,275 @@
+import queue
+import bisect
+import signal
+import asyncio
+import hashlib
+import multiprocessing
+from telegram import Bot, Update
+from telegram.ext import Application
+from utils.webhook import WebhookServer, stop_on_signals
+from utils.logger import LOGGER
+
+
+REPLICAS = 64 # virtual nodes per worker, evens out the share of chats
+ACK_TIMEOUT = 30 # seconds a worker may take to release or adopt its chats
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """ Consistent hashing of chat ids onto worker ids.
+
+    Adding or removing a worker only moves the chats of the ring segments
+    next to its virtual nodes, every other chat stays on its worker.
+    """
+
+    def __init__(self, nodes=(), replicas: int = REPLICAS) -> None:
+        self.replicas = replicas
+        self.nodes = set()
+        self._keys = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def add(self, node: int) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            key = _hash(f"{node}:{replica}")
+            position = bisect.bisect(self._keys, key)
+            self._keys.insert(position, key)
+            self._owners.insert(position, node)
+
+    def remove(self, node: int) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(key, owner) for key, owner in zip(self._keys, self._owners) if owner != node]
+        self._keys = [key for key, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, chat_id: int) -> int:
+        if not self._keys:
+            raise LookupError("No workers in the ring")
+        position = bisect.bisect(self._keys, _hash(str(chat_id))) % len(self._keys)
+        return self._owners[position]
+
+
+def chat_id_of(data: dict) -> int:
+    """ Chat of a raw update, read without building telegram objects """
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in data:
+            return data[key]['chat']['id']
+    if 'callback_query' in data:
+        query = data['callback_query']
+        message = query.get('message')
+        return message['chat']['id'] if message else query['from']['id']
+    for key in ('my_chat_member', 'chat_member', 'chat_join_request'):
+        if key in data:
+            return data[key]['chat']['id']
+    return 0
+
+
+class ShardRouter:
+    """ Front side of the sharded mode: owns the worker processes and routes
+    every update to the worker owning its chat.
+
+    Worker processes run `target(shard_id, inbox, acks, *args)`, usually via
+    serve_shard(). Rebalancing has two phases: every worker first persists
+    and drops the chats it no longer owns, then every worker loads the chats
+    it gained from the shared state store. Updates arriving in between wait
+    until the new ring is in place.
+    """
+
+    def __init__(self, target, args: tuple = ()) -> None:
+        self.context = multiprocessing.get_context('spawn')
+        self.target = target
+        self.args = args
+        self.workers = {} # shard_id -> (process, inbox)
+        self.acks = self.context.Queue()
+        self.ring = HashRing()
+        self.ready = asyncio.Event()
+        self.rebalance_lock = asyncio.Lock()
+        self.next_shard_id = 0
+        self.counters = {'routed': 0, 'rebalances': 0}
+
+    def _spawn(self) -> int:
+        shard_id = self.next_shard_id
+        self.next_shard_id += 1
+        inbox = self.context.Queue()
+        process = self.context.Process(
+            target=self.target,
+            args=(shard_id, inbox, self.acks, *self.args),
+            name=f"shard-{shard_id}",
+            daemon=True
+        )
+        process.start()
+        self.workers[shard_id] = (process, inbox)
+        return shard_id
+
+    async def start(self, num_workers: int) -> None:
+        for _ in range(num_workers):
+            self._spawn()
+        await self._rebalance(list(self.workers))
+
+    async def dispatch(self, data: dict) -> None:
+        """ Route a raw update, a WebhookServer dispatch callback """
+        if not self.ready.is_set():
+            await self.ready.wait()
+        shard_id = self.ring.node_for(chat_id_of(data))
+        self.workers[shard_id][1].put(('update', data))
+        self.counters['routed'] += 1
+
+    async def _broadcast(self, message: tuple, shard_ids: list) -> None:
+        """ Send a control message and wait until every worker acknowledged it """
+        for shard_id in shard_ids:
+            self.workers[shard_id][1].put(message)
+        loop = asyncio.get_running_loop()
+        pending = set(shard_ids)
+        while pending:
+            try:
+                shard_id = await loop.run_in_executor(None, self.acks.get, True, ACK_TIMEOUT)
+            except queue.Empty:
+                dead = {shard_id for shard_id in pending if not self.workers[shard_id][0].is_alive()}
+                if not dead:
+                    continue
+                LOGGER.error(f"Shards {sorted(dead)} died during rebalancing")
+                pending -= dead
+                continue
+            pending.discard(shard_id)
+
+    async def _rebalance(self, nodes: list) -> None:
+        async with self.rebalance_lock:
+            self.ready.clear()
+            alive = [shard_id for shard_id, (process, _) in self.workers.items() if process.is_alive()]
+            nodes = [shard_id for shard_id in nodes if shard_id in alive]
+            await self._broadcast(('release', nodes), alive)
+            await self._broadcast(('adopt', nodes), alive)
+            self.ring = HashRing(nodes)
+            self.counters['rebalances'] += 1
+            self.ready.set()
+            LOGGER.info(f"Shards rebalanced: {len(nodes)} workers")
+
+    async def add_worker(self) -> int:
+        shard_id = self._spawn()
+        await self._rebalance(list(self.ring.nodes) + [shard_id])
+        return shard_id
+
+    async def remove_worker(self, shard_id: int = None) -> None:
+        if len(self.ring) <= 1:
+            LOGGER.warning("The last shard can't be removed")
+            return
+        if shard_id is None:
+            shard_id = max(self.ring.nodes)
+        # the leaving worker releases all of its chats before it stops
+        await self._rebalance([node for node in self.ring.nodes if node != shard_id])
+        await self._stop_worker(shard_id)
+
+    async def _stop_worker(self, shard_id: int) -> None:
+        process, inbox = self.workers.pop(shard_id)
+        inbox.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, process.join, ACK_TIMEOUT)
+
+    async def watch(self, interval: float = 1) -> None:
+        """ Take crashed workers out of the ring, their chats move to the others """
+        while True:
+            await asyncio.sleep(interval)
+            dead = [shard_id for shard_id, (process, _) in self.workers.items() if not process.is_alive()]
+            if not dead:
+                continue
+            LOGGER.error(f"Shards {dead} died, rebalancing their chats")
+            for shard_id in dead:
+                del self.workers[shard_id]
+            if self.workers:
+                await self._rebalance(list(self.workers))
+
+    async def stop(self) -> None:
+        for shard_id in list(self.workers):
+            await self._stop_worker(shard_id)
+
+
+async def serve_shard(application: Application, shard_id: int, inbox, acks, release, adopt) -> None:
+    """ Worker side: feed routed updates into the application.
+
+    `release(application, owns, workers)` must persist and drop the games of
+    chats for which `owns(chat_id)` is False, `adopt(application, owns, workers)`
+    must load the owned games from the shared store. `workers` is the number
+    of workers in the new ring, e.g. to share the bot-wide budgets.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def handle(message: tuple) -> None:
+        kind, payload = message
+        if kind == 'update':
+            await application.update_queue.put(Update.de_json(payload, application.bot))
+            return
+
+        ring = HashRing(payload)
+        owns = lambda chat_id: shard_id in ring.nodes and ring.node_for(chat_id) == shard_id # noqa: E731
+        await application.update_queue.join() # let the running updates finish first
+        if kind == 'release':
+            await release(application, owns, len(ring))
+        elif kind == 'adopt':
+            await adopt(application, owns, len(ring))
+        acks.put(shard_id)
+
+    async with application:
+        await application.start()
+        while True:
+            message = await loop.run_in_executor(None, inbox.get)
+            # drain whatever else is waiting without another thread hop
+            while message is not None:
+                await handle(message)
+                try:
+                    message = inbox.get_nowait()
+                except queue.Empty:
+                    break
+            if message is None:
+                break
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+async def serve_sharded(
+    router: ShardRouter,
+    num_workers: int,
+    server: WebhookServer,
+    bot: Bot,
+    url: str,
+    allowed_updates: list,
+    metrics_server=None
+) -> None:
+    """ Front process: webhook receiver routing updates to the workers.
+    SIGUSR1 adds a worker, SIGUSR2 removes one """
+    stop_event = stop_on_signals()
+    loop = asyncio.get_running_loop()
+    for scale_signal, scale in ((signal.SIGUSR1, router.add_worker), (signal.SIGUSR2, router.remove_worker)):
+        try:
+            loop.add_signal_handler(scale_signal, lambda scale=scale: asyncio.ensure_future(scale()))
+        except (NotImplementedError, AttributeError): # Windows
+            pass
+
+    await router.start(num_workers)
+    async with bot:
+        await bot.set_webhook(url=url, secret_token=server.secret_token, allowed_updates=allowed_updates)
+    await server.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+    watcher = asyncio.create_task(router.watch())
+    try:
+        await stop_event.wait()
+    finally:
+        watcher.cancel()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await server.stop()
+        await router.stop()
@@ -0,0 +1,176 @@
+import hmac
+import json
+import signal
+import asyncio
+from telegram import Update
+from telegram.ext import Application
+from utils.logger import LOGGER
+
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024 # Telegram updates are a few KB at most
+
+RESPONSES = {
+    200: b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n",
+    400: b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n",
+    403: b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n",
+    404: b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n",
+    405: b"HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n",
+    413: b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n",
+}
+
+
+def application_dispatcher(application: Application):
+    """ Dispatch callback handing updates to the application's update queue """
+    async def dispatch(data: dict) -> None:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    return dispatch
+
+
+class WebhookServer:
+    """ Small asyncio HTTP server receiving updates from Telegram.
+
+    A request is answered with 200 as soon as `dispatch(update_dict)` returns,
+    e.g. once the update is in the application's update queue; the handlers
+    run in the background. At most `max_concurrency` request bodies are
+    parsed and dispatched at the same time.
+    """
+
+    def __init__(
+        self,
+        dispatch,
+        host: str,
+        port: int,
+        path: str,
+        secret_token: str = None,
+        max_concurrency: int = 64,
+        record_path: str = None
+    ) -> None:
+        self.dispatch = dispatch
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.record_file = open(record_path, 'a', encoding='utf-8') if record_path else None
+        self.server = None
+        self.counters = {'accepted': 0, 'rejected': 0}
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        LOGGER.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.record_file is not None:
+            self.record_file.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            keep_alive = True
+            while keep_alive:
+                status, keep_alive = await self._handle_request(reader)
+                if status is None:
+                    break
+                if status != 200:
+                    self.counters['rejected'] += 1
+                    keep_alive = False
+                writer.write(RESPONSES[status])
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader) -> tuple:
+        """ Returns (status, keep_alive), status is None on a closed connection """
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None, False
+        if len(head) > MAX_HEADER_SIZE:
+            return 413, False
+
+        request_line, *header_lines = head.decode('latin-1').split("\r\n")
+        method, path, version = (request_line.split(" ") + ["", ""])[:3]
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            return 400, False
+        if length > MAX_BODY_SIZE:
+            return 413, False
+
+        body = await reader.readexactly(length)
+        if path != self.path:
+            return 404, False
+        if method != "POST":
+            return 405, False
+        if self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(), self.secret_token.encode()
+        ):
+            return 403, False
+
+        async with self.semaphore:
+            try:
+                data = json.loads(body)
+                if not isinstance(data, dict):
+                    raise ValueError("update is not an object")
+            except ValueError as e:
+                LOGGER.warning(f"Bad update received on the webhook: {e}")
+                return 400, False
+            if self.record_file is not None:
+                self.record_file.write(body.decode('utf-8') + "\n")
+            try:
+                await self.dispatch(data)
+            except (ValueError, TypeError, KeyError) as e:
+                LOGGER.warning(f"Bad update received on the webhook: {e}")
+                return 400, False
+
+        self.counters['accepted'] += 1
+        return 200, keep_alive
+
+
+def stop_on_signals() -> asyncio.Event:
+    """ Event set on SIGINT/SIGTERM """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(stop_signal, stop_event.set)
+        except NotImplementedError: # Windows
+            pass
+    return stop_event
+
+async def serve_webhook(application: Application, server: WebhookServer, url: str, allowed_updates: list) -> None:
+    """ Webhook counterpart of Application.run_polling() """
+    stop_event = stop_on_signals()
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=server.secret_token,
+            allowed_updates=allowed_updates
+        )
+        await application.start()
+        await server.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)